@@ -6,8 +6,13 @@ import traceback
 
 from discord.ext import commands
 from coc.ext import discordlinks
-from cogs.utils import context
+from cogs.utils import context, tables
 from cogs.utils.db import Table
+from cogs.utils.event_calendar import EventCalendar
+from cogs.utils.players import PlayerIndex
+from cogs.utils.updates import PlayerUpdates
+from cogs.utils.registry import ClanRegistry
+from cogs.utils.roster import RosterTracker
 from datetime import datetime
 from loguru import logger
 from config import settings
@@ -66,6 +71,12 @@ class Robot(commands.Bot):
         self.links = links_client
         self.logger = logger
         self.color = discord.Color.dark_red()
+        self.clan_registry = ClanRegistry(self)
+        self.calendar = EventCalendar(self)
+        self.rosters = RosterTracker(self)
+        self.players = PlayerIndex(self)
+        # player update registrations, shared by every cog using the events client
+        self.player_updates = PlayerUpdates(self.coc)
         self.loop.create_task(self.after_ready())
 
         for extension in initial_extensions:
@@ -111,7 +122,7 @@ class Robot(commands.Bot):
                 self.logger.error(f"In {ctx.command.qualified_name}:", file=sys.stderr)
                 traceback.print_tb(original.__traceback__)
                 self.logger.error(f"{original.__class__.__name__}: {original}", file=sys.stderr)
-        elif isinstance(error, commands.ArgumentParsingError):
+        elif isinstance(error, (commands.ArgumentParsingError, commands.BadArgument)):
             await ctx.send(error)
 
     async def on_error(self, event_method, *args, **kwargs):
@@ -139,6 +150,10 @@ class Robot(commands.Bot):
         logger.add(self.send_log, level=log_level)
 
     async def close(self):
+        self.clan_registry.close()
+        self.calendar.close()
+        self.rosters.close()
+        self.players.close()
         await super().close()
         await self.coc.close()
 
@@ -147,6 +162,8 @@ if __name__ == "__main__":
     loop = asyncio.get_event_loop()
     try:
         pool = loop.run_until_complete(Table.create_pool(settings['pg']['uri'], max_size=15))
+        for table in Table.all_tables():
+            loop.run_until_complete(pool.execute(table.create_table()))
         bot = Robot()
         bot.pool = pool
         bot.loop = loop
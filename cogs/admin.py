@@ -146,6 +146,18 @@ class Admin(commands.Cog):
         else:
             await ctx.send('\N{OK HAND SIGN}')
 
+    @_reload.command(name='events', hidden=True)
+    async def _reload_events(self, ctx):
+        """Reloads the event calendar from rcs_events."""
+        await self.bot.calendar.reload()
+        await ctx.send(f'\N{OK HAND SIGN} {len(self.bot.calendar.events)} events loaded')
+
+    @_reload.command(name='clans', hidden=True)
+    async def _reload_clans(self, ctx):
+        """Reloads the UW clan list from uw_clans."""
+        await self.bot.clan_registry.reload()
+        await ctx.send(f'\N{OK HAND SIGN} {len(self.bot.clan_registry)} clans loaded')
+
     _GIT_PULL_REGEX = re.compile(r'\s*(?P<filename>.+?)\s*\|\s*[0-9]+\s*[+-]+')
 
     def find_modules_from_git(self, output):
@@ -417,6 +429,42 @@ class Admin(commands.Cog):
         else:
             await ctx.send(fmt)
 
+    @commands.command(hidden=True)
+    async def dbbench(self, ctx, runs: int = 20):
+        """Compare push player's neighbour lookup on a new connection per call against the pool."""
+        # imported here for the same reason as in sql above
+        from .utils.cache import NEIGHBORS_SQL, get_neighbors
+        from .utils.formats import TabularData, plural
+        from config import settings
+        import asyncpg
+        import statistics
+
+        tag = await ctx.db.fetchval('SELECT player_tag FROM uw_push_leaderboard WHERE rank = 1')
+        if tag is None:
+            return await ctx.send('The push leaderboard is empty.')
+
+        async def connect_each_time():
+            conn = await asyncpg.connect(settings['pg']['uri'])
+            try:
+                await conn.fetch(NEIGHBORS_SQL, tag)
+            finally:
+                await conn.close()
+
+        async def pooled():
+            await get_neighbors(self.bot.pool, f'#{tag}')
+
+        table = TabularData()
+        table.set_columns(['Strategy', 'Median (ms)', 'Max (ms)'])
+        for name, call in (('connect per call', connect_each_time), ('shared pool', pooled)):
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                await call()
+                timings.append((time.perf_counter() - start) * 1000.0)
+            table.add_row([name, f'{statistics.median(timings):.2f}', f'{max(timings):.2f}'])
+
+        await ctx.send(f'```\n{table.render()}\n```\n*{plural(runs):run} each*')
+
     @commands.command(hidden=True)
     async def sql_table(self, ctx, *, table_name: str):
         """Runs a query describing the table schema."""
@@ -1,11 +1,18 @@
 import asyncio
+import coc
 import math
 import re
+import time
 
 from discord.ext import commands, tasks
 from cogs.utils import formats
-from cogs.utils.constants import clans
+from cogs.utils.cache import upsert_players
 from cogs.utils.converters import ClanConverter, PlayerConverter
+from cogs.utils.event_calendar import CLAN_GAMES
+from cogs.utils.fetch import fetch_clans, fetch_players, FETCH_CONCURRENCY
+from cogs.utils.ingest import bulk_insert
+from cogs.utils.scheduler import PollScheduler
+from config import settings
 from datetime import datetime, timedelta
 
 tag_validator = re.compile("^#?[PYLQGRJCUV0289]+$")
@@ -17,55 +24,68 @@ class Games(commands.Cog):
         self.bot = bot
         self.channel = None
         self.channel_id = 790235721470443522
+        self.concurrency = settings.get('games', {}).get('concurrency', FETCH_CONCURRENCY)
+        self.use_events = settings.get('games', {}).get('events', False)
+        # player_tag -> uw_clan_games row / last seen Games Champion value, for last_seen_event
+        self.participants = {}
+        self.last_seen = {}
+        self.last_seen_event = None
+        self.changed_count = 0
+        self.unchanged_count = 0
+        # tag -> clan tag of UW clan joiners not yet added to the event
+        self.joined = {}
+        self.started_event = None
+        self.progress_lock = asyncio.Lock()
+        if self.use_events:
+            # Games Champion changes arrive through on_games_achievement, so an hourly
+            # poll per player is only there to catch anything the events client missed
+            self.scheduler = PollScheduler(min_interval=3600, max_interval=3600)
+            self.bot.coc.add_events(self.on_games_achievement)
+        else:
+            self.scheduler = PollScheduler()
         self.start_games.start()
         self.update_games.start()
 
     def cog_unload(self):
         self.start_games.cancel()
         self.update_games.cancel()
+        if self.use_events:
+            self.bot.coc.remove_events(self.on_games_achievement)
+            self.bot.player_updates.remove_all("games")
 
     async def get_last_games(self):
-        """Get games ID from rcs_events for the most recent clan games"""
-        now = datetime.utcnow()
-        sql = ("SELECT event_id, MAX(end_time) as end_time " 
-               "FROM rcs_events "
-               "WHERE event_type_id = 1 AND end_time < $1 "
-               "GROUP BY event_id "
-               "ORDER BY end_time DESC "
-               "LIMIT 1")
-        row = await self.bot.pool.fetchrow(sql, now)
-        return row['event_id'], row['end_time']
+        """Get games ID and end time for the most recent clan games"""
+        await self.bot.calendar.wait_until_loaded()
+        event = self.bot.calendar.last(CLAN_GAMES)
+        return event['event_id'], event['end_time']
 
     async def get_current_games(self):
-        """Get games ID from RCS-events for the current clan games, if active (else None)"""
-        sql = ("SELECT event_id, player_points, clan_points  "
-               "FROM rcs_events "
-               "WHERE event_type_id = 1 AND CURRENT_TIMESTAMP BETWEEN start_time AND end_time")
-        row = await self.bot.pool.fetchrow(sql)
-        if row:
-            return {"games_id": row['event_id'],
-                    "player_points": row['player_points'],
-                    "clan_points": row['clan_points']}
+        """Get games ID for the current clan games, if active (else None)"""
+        await self.bot.calendar.wait_until_loaded()
+        event = self.bot.calendar.current(CLAN_GAMES)
+        if event:
+            return {"games_id": event['event_id'],
+                    "player_points": event['player_points'],
+                    "clan_points": event['clan_points']}
         else:
             return None
 
     async def get_next_games(self):
-        """Get games ID from rcs_events for the next clan games, if available (else None)"""
-        now = datetime.utcnow()
-        sql = ("SELECT event_id, MIN(start_time) as start_time "
-               "FROM rcs_events "
-               "WHERE event_type_id = 1 AND start_time > $1 "
-               "GROUP BY event_id")
-        row = await self.bot.pool.fetchrow(sql, now)
-        if row:
-            return row['event_id'], row['start_time']
+        """Get games ID and start time for the next clan games, if available (else None)"""
+        await self.bot.calendar.wait_until_loaded()
+        event = self.bot.calendar.next(CLAN_GAMES)
+        if event:
+            return event['event_id'], event['start_time']
         else:
             return None
 
     async def closest_games(self):
         """Get the most recent or next games, depending on which is closest"""
         last_games_id, _last = await self.get_last_games()
-        next_games_id, _next = await self.get_next_games()
+        next_games = await self.get_next_games()
+        if not next_games:
+            return "last", last_games_id
+        next_games_id, _next = next_games
         now = datetime.utcnow()
         time_to_last = now - _last
         time_to_next = _next - now
@@ -76,36 +96,48 @@ class Games(commands.Cog):
             # deal with next games
             return "next", next_games_id
 
+    async def snapshot_rosters(self):
+        """Fetch every UW clan and all of their members' profiles at once
+
+        Returns a list of (clan tag, Player) and the time the snapshot was taken.
+        """
+        await self.bot.clan_registry.wait_until_loaded()
+        taken_at = datetime.utcnow()
+        fetched_clans = await fetch_clans(self.bot.coc, self.bot.clan_registry.tags, limit=self.concurrency)
+        member_clans = {member.tag: clan.tag for clan in fetched_clans.values() for member in clan.members}
+        players = await fetch_players(self.bot.coc, list(member_clans), limit=self.concurrency)
+        return [(member_clans[tag], player) for tag, player in players.items()], taken_at
+
+    async def start_event(self, games_id):
+        """Record every member's starting points for the clan games
+
+        Returns the number of players added, when the snapshot was taken and how long it all took.
+        """
+        start = time.perf_counter()
+        snapshot, taken_at = await self.snapshot_rosters()
+        records = ((games_id,
+                    player.tag[1:],
+                    clan_tag[1:],
+                    player.get_achievement("Games Champion").value,
+                    0, None
+                    ) for clan_tag, player in snapshot)
+        count = await bulk_insert(self.bot.pool, "uw_clan_games",
+                                  ("event_id", "player_tag", "clan_tag", "starting_points", "current_points",
+                                   "max_reached"),
+                                  records, keys=("event_id", "player_tag"))
+        await upsert_players(self.bot.pool, [player for _, player in snapshot])
+        return count, taken_at, time.perf_counter() - start
+
     @tasks.loop(minutes=10)
     async def start_games(self):
         """Task to pull initial Games data for the new clan games"""
-        now = datetime.utcnow()
-        conn = self.bot.pool
-        games_id, start_time = await self.get_next_games()
-        # games_id = 22
-        if games_id:
-            # sql = "SELECT start_time FROM rcs_events WHERE event_id = $1"
-            # start_time = await conn.fetchval(sql, games_id)
-            if start_time - now < timedelta(minutes=10):
-                to_insert = []
-                counter = 0
-                async for clan in self.bot.coc.get_clans(clans):
-                    async for member in clan.get_detailed_members():
-                        counter += 1
-                        to_insert.append((counter,
-                                          games_id,
-                                          member.tag[1:],
-                                          clan.tag[1:],
-                                          member.get_achievement("Games Champion").value,
-                                          0, None
-                                          ))
-                sql = ("INSERT INTO uw_clan_games "
-                       "(event_id, player_tag, clan_tag, starting_points, current_points, max_reached) "
-                       "SELECT x.event_id, x.player_tag, x.clan_tag, x.starting_points, "
-                       "x.current_points, x.max_reached "
-                       "FROM unnest($1::uw_clan_games[]) as x")
-                await conn.execute(sql, to_insert)
-                self.bot.logger.info(f"{counter} players added to UW Clan Games event. Game on!")
+        # sleeps here until the next games are 10 minutes away
+        event = await self.bot.calendar.wait_for_event(CLAN_GAMES, lead=timedelta(minutes=10))
+        if event['start_time'] > datetime.utcnow() and event['event_id'] != self.started_event:
+            count, taken_at, elapsed = await self.start_event(event['event_id'])
+            self.started_event = event['event_id']
+            self.bot.logger.info(f"{count} players added to UW Clan Games event. Game on! "
+                                 f"(snapshot taken at {taken_at:%H:%M:%S} UTC in {elapsed:.2f}s)")
 
     @start_games.before_loop
     async def before_start_games(self):
@@ -114,61 +146,210 @@ class Games(commands.Cog):
     @commands.command(name="startnow", hidden=True)
     @commands.is_owner()
     async def manual_start(self, ctx):
-        conn = self.bot.pool
         games_id = 22
-        to_insert = []
-        counter = 0
-        async for clan in self.bot.coc.get_clans(clans):
-            async for member in clan.get_detailed_members():
-                counter += 1
-                to_insert.append((counter,
-                                  games_id,
-                                  member.tag[1:],
-                                  clan.tag[1:],
-                                  member.get_achievement("Games Champion").value,
-                                  0, None
-                                  ))
-        sql = ("INSERT INTO uw_clan_games "
-               "(event_id, player_tag, clan_tag, starting_points, current_points, max_reached) "
-               "SELECT x.event_id, x.player_tag, x.clan_tag, x.starting_points, "
-               "x.current_points, x.max_reached "
-               "FROM unnest($1::uw_clan_games[]) as x")
-        await conn.execute(sql, to_insert)
-        await ctx.send(f"{counter} players added to UW Clan Games event. Game on!")
-
-    @tasks.loop(minutes=12)
+        count, taken_at, elapsed = await self.start_event(games_id)
+        await ctx.send(f"{count} players added to UW Clan Games event. Game on! "
+                       f"(snapshot taken at {taken_at:%H:%M:%S} UTC in {elapsed:.2f}s)")
+
+    async def load_participants(self, games_id):
+        """Load the event's players and their last known Games Champion value, and queue them for polling"""
+        sql = ("SELECT player_tag, clan_tag, starting_points, current_points, max_reached "
+               "FROM uw_clan_games "
+               "WHERE event_id = $1")
+        fetch = await self.bot.pool.fetch(sql, games_id)
+        if self.use_events:
+            self.bot.player_updates.remove_all("games")
+        self.participants = {row['player_tag']: dict(row) for row in fetch}
+        self.last_seen = {row['player_tag']: row['starting_points'] + row['current_points'] for row in fetch}
+        self.last_seen_event = games_id
+        self.joined.clear()
+        self.scheduler.clear()
+        for row in fetch:
+            if not row['max_reached']:
+                self.scheduler.add(row['player_tag'])
+        if self.use_events:
+            self.bot.player_updates.add("games", *[f"#{tag}" for tag in self.scheduler])
+
+    def close_event(self):
+        """Drop everything held for the games that just ended"""
+        self.bot.logger.info(f"UW Clan Games event {self.last_seen_event} is over, "
+                             f"stopped tracking {len(self.participants)} players")
+        if self.use_events:
+            self.bot.player_updates.remove_all("games")
+        self.participants = {}
+        self.last_seen = {}
+        self.last_seen_event = None
+        self.joined.clear()
+        self.scheduler.clear()
+
+    def stop_tracking(self, tag):
+        self.scheduler.remove(tag)
+        if self.use_events:
+            self.bot.player_updates.remove("games", f"#{tag}")
+
+    async def record_progress(self, games, players):
+        """Work out each player's points, announce anyone who just maxed out and write back what changed
+
+        Returns the set of tags that changed and the time spent in the DB.
+        """
+        # the poller and the events handler can both get to a player at once; taking
+        # them one at a time means the second sees the first's result and does nothing
+        async with self.progress_lock:
+            now = datetime.utcnow()
+            to_update = []
+            maxed = []
+            for player in players:
+                tag = player.tag[1:]
+                row = self.participants[tag]
+                value = player.get_achievement("Games Champion").value
+                if self.last_seen.get(tag) == value:
+                    continue
+                current_points = value - row['starting_points']
+                max_reached = row['max_reached']
+                if current_points >= games['player_points'] and not max_reached:
+                    max_reached = now
+                    maxed.append((player, row['clan_tag']))
+                to_update.append((tag, current_points, max_reached, value))
+            self.changed_count += len(to_update)
+            self.unchanged_count += len(players) - len(to_update)
+            if not to_update:
+                return set(), 0.0
+            tags, points, reached, values = zip(*to_update)
+            sql = ("UPDATE uw_clan_games AS g "
+                   "SET current_points = x.current_points, "
+                   "max_reached = COALESCE(g.max_reached, x.max_reached) "
+                   "FROM unnest($2::text[], $3::int[], $4::timestamp[]) "
+                   "AS x(player_tag, current_points, max_reached) "
+                   "WHERE g.event_id = $1 AND g.player_tag = x.player_tag")
+            start = time.perf_counter()
+            await self.bot.pool.execute(sql, games['games_id'], tags, points, reached)
+            db_time = time.perf_counter() - start
+            # the in-memory copy only moves on once the write has gone through, so a failed
+            # write is picked up again by the next poll
+            for tag, current_points, max_reached, value in to_update:
+                row = self.participants[tag]
+                row['current_points'] = current_points
+                row['max_reached'] = max_reached
+                self.last_seen[tag] = value
+                if max_reached:
+                    # nothing left to track once a player has maxed out
+                    self.stop_tracking(tag)
+            for player, clan_tag in maxed:
+                clan_name = self.bot.clan_registry.get_name(clan_tag)
+                content = f":trophy: {player.name} ({clan_name}) just hit max points for Clan Games!"
+                await self.channel.send(content)
+            return set(tags), db_time
+
+    async def add_joiners(self, games_id):
+        """Start tracking players who joined a UW clan after the games started"""
+        joined = {tag: clan_tag for tag, clan_tag in self.joined.items() if tag[1:] not in self.participants}
+        self.joined.clear()
+        fetched = await fetch_players(self.bot.coc, list(joined), limit=self.concurrency)
+        rows = [{"player_tag": player.tag[1:],
+                 "clan_tag": joined[tag][1:],
+                 "starting_points": player.get_achievement("Games Champion").value,
+                 "current_points": 0,
+                 "max_reached": None} for tag, player in fetched.items()]
+        records = ((games_id, row['player_tag'], row['clan_tag'], row['starting_points'], 0, None) for row in rows)
+        await bulk_insert(self.bot.pool, "uw_clan_games",
+                          ("event_id", "player_tag", "clan_tag", "starting_points", "current_points",
+                           "max_reached"),
+                          records, keys=("event_id", "player_tag"))
+        for row in rows:
+            self.participants[row['player_tag']] = row
+            self.last_seen[row['player_tag']] = row['starting_points']
+            self.scheduler.add(row['player_tag'])
+        if self.use_events:
+            self.bot.player_updates.add("games", *[f"#{row['player_tag']}" for row in rows])
+        return len(rows)
+
+    @commands.Cog.listener()
+    async def on_roster_join(self, tag, clan):
+        # picked up by the next update_games tick
+        if self.last_seen_event and tag[1:] not in self.participants:
+            self.joined[tag] = clan.tag
+
+    @coc.PlayerEvents.achievement_change()
+    async def on_games_achievement(self, old_player, new_player, achievement):
+        """Record clan games progress as soon as the events client sees it"""
+        if achievement.name != "Games Champion" or new_player.tag[1:] not in self.participants:
+            return
+        games = await self.get_current_games()
+        if not games or games['games_id'] != self.last_seen_event:
+            return
+        if not self.channel:
+            self.channel = self.bot.get_channel(self.channel_id)
+        await self.record_progress(games, [new_player])
+
+    @tasks.loop(minutes=1)
     async def update_games(self):
-        """Task to pull API data for clan games"""
+        """Task to pull API data for the clan games players that are due a poll"""
         conn = self.bot.pool
         games = await self.get_current_games()
-        now = datetime.utcnow()
         if not self.channel:
             self.channel = self.bot.get_channel(self.channel_id)
-        if games:
-            sql = "SELECT player_tag, clan_tag, starting_points, max_reached FROM uw_clan_games WHERE event_id = $1"
-            players = await conn.fetch(sql, games['games_id'])
-            for row in players:
-                player = await self.bot.coc.get_player(row['player_tag'])
-                current_points = player.get_achievement("Games Champion").value - row['starting_points']
-                if current_points >= games['player_points'] and not row['max_reached']:
-                    max_reached = now
-                    sql = ("UPDATE uw_clan_games "
-                           "SET current_points = $1, max_reached = $2 "
-                           "WHERE player_tag = $3")
-                    await conn.execute(sql, current_points, max_reached, player.tag[1:])
-                    clan = await self.bot.coc.get_clan(row['clan_tag'])
-                    content = f":trophy: {player.name} ({clan.name}) just hit max points for Clan Games!"
-                    await self.channel.send(content)
-                else:
-                    sql = ("UPDATE uw_clan_games "
-                           "SET current_points = $1 "
-                           "WHERE player_tag = $2")
-                    await conn.execute(sql, current_points, player.tag[1:])
-            print("Done")
+        if not games:
+            if self.last_seen_event:
+                self.close_event()
+            # nothing to do until the next games start
+            await self.bot.calendar.wait_for_event(CLAN_GAMES)
+            games = await self.get_current_games()
+            if not games:
+                return
+        start = time.perf_counter()
+        db_time = 0.0
+        statements = 0
+        if self.last_seen_event != games['games_id']:
+            await self.load_participants(games['games_id'])
+            db_time += time.perf_counter() - start
+            statements += 1
+        if self.joined:
+            added = await self.add_joiners(games['games_id'])
+            self.bot.logger.info(f"{added} new clan members added to UW Clan Games event")
+        due = self.scheduler.pop_due(len(self.participants))
+        if not due:
+            return
+        changed = set()
+        polled = False
+        try:
+            fetched = await fetch_players(self.bot.coc, due, limit=self.concurrency)
+            changed, update_time = await self.record_progress(games, list(fetched.values()))
+            polled = True
+        finally:
+            # pop_due took these out of the queue, so they have to go back in even if the
+            # poll failed; those are retried at the shortest interval rather than backed off
+            for tag in due:
+                self.scheduler.reschedule(tag, changed=tag in changed or not polled)
+        if changed:
+            db_time += update_time
+            statements += 1
+        if fetched:
+            db_start = time.perf_counter()
+            await upsert_players(conn, fetched.values())
+            self.bot.players.update_players(fetched.values())
+            db_time += time.perf_counter() - db_start
+            statements += 1
+        self.bot.logger.debug(f"Clan games update: {len(due)} API calls for {len(self.scheduler)} active players "
+                              f"in {time.perf_counter() - start:.2f}s, "
+                              f"{len(changed)} changed, {len(fetched) - len(changed)} unchanged "
+                              f"({statements} statements, {db_time * 1000:.2f}ms DB)")
 
     @update_games.before_loop
     async def before_update_games(self):
         await self.bot.wait_until_ready()
+        games = await self.get_current_games()
+        if games:
+            await self.load_participants(games['games_id'])
+
+    @commands.command(name="gamesstats", hidden=True)
+    @commands.is_owner()
+    async def games_stats(self, ctx):
+        """Show how much work the clan games polling is saving"""
+        scheduler = self.scheduler
+        await ctx.send(f"Players: {len(self.participants)} ({len(scheduler)} still polled)\n"
+                       f"Rows changed/unchanged: {self.changed_count}/{self.unchanged_count}\n"
+                       f"API calls: {scheduler.polls} vs {scheduler.baseline:.0f} at a fixed 12 minutes "
+                       f"({scheduler.saving:.0%} saved)")
 
     @commands.group(invoke_without_command=True)
     async def games(self, ctx, *, clan: ClanConverter = None):
@@ -195,9 +376,8 @@ class Games(commands.Cog):
             fetch = await conn.fetch(sql, games['games_id'])
             data = []
             for row in fetch:
-                clan = await self.bot.coc.get_clan(row['clan_tag'])
                 prefix = "* " if row['clan_total'] >= games['clan_points'] else ""
-                data.append([row['clan_total'], prefix + clan.name])
+                data.append([row['clan_total'], prefix + self.bot.clan_registry.get_name(row['clan_tag'])])
             page_count = math.ceil(len(data) / 25)
             title = "UWF Clan Games Points"
             ctx.icon = "https://cdn.discordapp.com/emojis/639623355770732545.png"
@@ -206,8 +386,7 @@ class Games(commands.Cog):
         else:
             closest, games_id = await self.closest_games()
             if closest == "next":
-                sql = "SELECT start_time FROM rcs_events WHERE event_id = $1"
-                next_start = await conn.fetchval(sql, games_id)
+                next_start = self.bot.calendar.get(games_id)['start_time']
                 # TODO Next line will need formatting
                 return await ctx.send(f"Clan Games are not currently active. Next games starts at {next_start}")
             else:
@@ -217,11 +396,11 @@ class Games(commands.Cog):
                        "GROUP BY clan_tag "
                        "ORDER BY clan_total DESC")
                 fetch = await conn.fetch(sql, games_id)
+                clan_points = self.bot.calendar.get(games_id)['clan_points']
                 data = []
                 for row in fetch:
-                    clan = await self.bot.coc.get_clan(row['clan_tag'])
-                    prefix = "* " if row['clan_total'] >= games['clan_points'] else ""
-                    data.append([row['clan_total'], prefix + clan.name])
+                    prefix = "* " if row['clan_total'] >= clan_points else ""
+                    data.append([row['clan_total'], prefix + self.bot.clan_registry.get_name(row['clan_tag'])])
                 page_count = math.ceil(len(data) / 25)
                 title = "Last Clan Games Points"
                 ctx.icon = "https://cdn.discordapp.com/emojis/639623355770732545.png"
@@ -235,16 +414,18 @@ class Games(commands.Cog):
             conn = self.bot.pool
             games = await self.get_current_games()
             if games:
-                sql = ("SELECT player_tag, current_points "
-                       "FROM uw_clan_games "
-                       "WHERE event_id = $1 "
-                       "ORDER BY current_points DESC "
+                sql = ("SELECT g.current_points, "
+                       "COALESCE(p.player_name, g.player_tag) AS player_name, "
+                       "COALESCE(p.clan_name, g.clan_tag) AS clan_name "
+                       "FROM uw_clan_games g "
+                       "LEFT JOIN uw_players p ON p.player_tag = g.player_tag "
+                       "WHERE g.event_id = $1 "
+                       "ORDER BY g.current_points DESC "
                        "LIMIT 10")
                 fetch = await conn.fetch(sql, games['games_id'])
                 data = []
                 for row in fetch:
-                    player = await self.bot.coc.get_player(row['player_tag'])
-                    data.append([row['current_points'], f"{player.name} ({player.clan.name})"])
+                    data.append([row['current_points'], f"{row['player_name']} ({row['clan_name']})"])
                 title = "UW Top Ten for Clan Games"
                 ctx.icon = "https://cdn.discordapp.com/emojis/635642869750824980.png"
                 p = formats.TablePaginator(ctx, data=data, title=title, page_count=1)
@@ -260,8 +441,7 @@ class Games(commands.Cog):
         fetch = await conn.fetch(sql)
         data = []
         for row in fetch:
-            clan = await self.bot.coc.get_clan(row['clan_tag'])
-            data.append([row['clan_avg'], clan.name])
+            data.append([row['clan_avg'], self.bot.clan_registry.get_name(row['clan_tag'])])
         page_count = math.ceil(len(data) / 25)
         title = "UWF Clan Games Averages"
         ctx.icon = "https://cdn.discordapp.com/emojis/639623355770732545.png"
@@ -277,22 +457,19 @@ class Games(commands.Cog):
         """
         async with ctx.typing():
             conn = self.bot.pool
-            sql = ("SELECT player_points "
-                   "FROM rcs_events "
-                   "WHERE event_type_id = 1 and start_time < NOW() "
-                   "ORDER BY start_time DESC")
-            player_points = await conn.fetchval(sql)
-            sql = ("SELECT player_tag, current_points "
-                   "FROM uw_clan_games "
-                   "WHERE clan_tag = $1"
-                   "ORDER BY current_points DESC")
+            await self.bot.calendar.wait_until_loaded()
+            player_points = self.bot.calendar.latest(CLAN_GAMES)['player_points']
+            sql = ("SELECT g.current_points, COALESCE(p.player_name, g.player_tag) AS player_name "
+                   "FROM uw_clan_games g "
+                   "LEFT JOIN uw_players p ON p.player_tag = g.player_tag "
+                   "WHERE g.clan_tag = $1 "
+                   "ORDER BY g.current_points DESC")
             fetch = await conn.fetch(sql, clan.tag[1:])
             clan_total = 0
             clan_size = len(fetch)
             data = []
             for member in fetch:
-                player = await self.bot.coc.get_player(member['player_tag'])
-                player_name = player.name
+                player_name = member['player_name']
                 if member['current_points'] >= player_points:
                     clan_total += player_points
                     data.append([member['current_points'], "* " + player_name])
@@ -1,64 +1,411 @@
+import coc
 import discord
 import time
 
 from discord.ext import commands, tasks
-from cogs.utils.cache import get_neighbors
-from cogs.utils.constants import clans
+from cogs.utils.cache import get_neighbors, upsert_players
 from cogs.utils.converters import PlayerConverter, ClanConverter
+from cogs.utils.event_calendar import TROPHY_PUSH
+from cogs.utils.fetch import fetch_clans, fetch_players
+from cogs.utils.ingest import bulk_insert
+from cogs.utils.ranking import RankIndex
+from cogs.utils.scoring import ScoringRules
+from cogs.utils.stats import PushStats
 from cogs.utils import formats
-from datetime import datetime
+from config import settings
+from datetime import datetime, timedelta
+
+PUSH_COLUMNS = ("player_tag", "player_name", "clan_tag", "clan_name",
+                "starting_trophies", "current_trophies", "best_trophies", "th_level", "score", "event_id")
+
+# Scores are worked out in Python when trophies are written and stored in an indexed
+# column, so nothing that reads uw_push_1 has to evaluate the scoring rules.
+# uw_push_leaderboard is a precomputed, ranked copy of it so that the push commands
+# are index range scans. Refreshed (concurrently, so readers are never blocked)
+# after every update. uw_push_1 only ever holds the latest push; when a new one opens
+# the previous rows are moved to uw_push_archive.
+SCHEMA_SQL = """
+ALTER TABLE uw_push_1 ADD COLUMN IF NOT EXISTS score INTEGER;
+ALTER TABLE uw_push_1 ADD COLUMN IF NOT EXISTS event_id INTEGER;
+CREATE INDEX IF NOT EXISTS uw_push_1_score_idx ON uw_push_1 (score DESC, player_tag);
+
+CREATE TABLE IF NOT EXISTS uw_push_archive (
+    event_id INTEGER,
+    player_tag TEXT,
+    player_name TEXT,
+    clan_tag TEXT,
+    clan_name TEXT,
+    starting_trophies INTEGER,
+    current_trophies INTEGER,
+    best_trophies INTEGER,
+    th_level INTEGER,
+    score INTEGER
+);
+CREATE INDEX IF NOT EXISTS uw_push_archive_event_idx ON uw_push_archive (event_id, score DESC);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS uw_push_leaderboard AS
+SELECT ROW_NUMBER() OVER (ORDER BY score DESC, player_tag) AS rank, score,
+       player_tag, player_name, clan_tag, clan_name, th_level
+FROM uw_push_1
+WHERE score IS NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS uw_push_leaderboard_rank_idx ON uw_push_leaderboard (rank);
+CREATE INDEX IF NOT EXISTS uw_push_leaderboard_clan_idx ON uw_push_leaderboard (clan_tag, rank);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS uw_push_clan_totals AS
+SELECT ROW_NUMBER() OVER (ORDER BY SUM(score) DESC, clan_name) AS rank, SUM(score) AS total, clan_name
+FROM uw_push_leaderboard
+GROUP BY clan_name;
+CREATE UNIQUE INDEX IF NOT EXISTS uw_push_clan_totals_rank_idx ON uw_push_clan_totals (rank);
+
+CREATE INDEX IF NOT EXISTS uw_push_history_player_idx ON uw_push_history (player_tag, taken_at DESC);
+"""
+
+# uw_push_history only gets a row when a player's trophies change, so a player's
+# trophies at any moment are those of their latest row at or before it (or their
+# starting trophies if there is none). Past each age, points are thinned out to
+# the last one in every bucket of that size.
+HISTORY_RESOLUTION = ((timedelta(days=2), "hour"),
+                      (timedelta(days=7), "day"))
+
+
+def push_record(player, rules, event_id):
+    """Build a uw_push_1 row for a player joining the push"""
+    trophies = player.trophies if player.trophies <= 5000 else 5000
+    return (player.tag[1:],
+            player.name,
+            player.clan.tag[1:],
+            player.clan.name,
+            trophies,
+            trophies,
+            player.best_trophies,
+            player.town_hall,
+            rules.score(player.town_hall, trophies),
+            event_id
+            )
 
 
 class Push(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.title = "Unfair Warfare Trophy Push"
-        self.start_time = datetime(2020, 5, 25, 5, 0, 0)
-        self.end_time = datetime(2020, 6, 29, 5, 0, 0)
+        # the rcs_events push window being tracked, if one is open
+        self.event = None
+        self.event_id = None
+        self.rules = ScoringRules()
+        self.use_events = settings.get('push', {}).get('events', False)
+        # cycles between full profile refreshes, to pick up TH changes
+        self.profile_cycles = 6
+        self.cycles_since_profiles = self.profile_cycles
+        self.batch_size = 500
+        # tags in uw_push_1, and UW clan joiners not yet added to it
+        self.participants = None
+        self.joined = set()
+        self.leaderboard_stale = False
+        # in-memory copy of the leaderboard order for push player
+        self.ranks = RankIndex()
+        self.th_levels = {}
+        # numbers for push info, so it doesn't have to scan uw_push_1
+        self.stats = PushStats()
+        if self.use_events:
+            # on_push_trophies writes trophies as they change; the hourly cycle still picks up
+            # TH levels, new joiners and anyone the events client lost track of
+            self.update_push.change_interval(minutes=60)
+            self.bot.coc.add_events(self.on_push_trophies)
+            self.refresh_stale_leaderboard.start()
         self.update_push.start()
+        self.compact_history.start()
         # self.push_start.start()
 
     def cog_unload(self):
         self.update_push.cancel()
+        self.refresh_stale_leaderboard.cancel()
+        self.compact_history.cancel()
         # self.push_start.cancel()
+        if self.use_events:
+            self.bot.coc.remove_events(self.on_push_trophies)
+            self.bot.player_updates.remove_all("push")
+
+    @coc.PlayerEvents.trophies()
+    async def on_push_trophies(self, old_player, new_player):
+        """Record trophy changes as soon as the events client sees them"""
+        if not self.event or not self.event['start_time'] < datetime.utcnow() < self.event['end_time']:
+            return
+        score = self.rules.score(new_player.town_hall, new_player.trophies)
+        async with self.bot.pool.acquire() as conn:
+            async with conn.transaction():
+                sql = "UPDATE uw_push_1 SET current_trophies = $1, th_level = $2, score = $3 WHERE player_tag = $4"
+                await conn.execute(sql, new_player.trophies, new_player.town_hall, score, new_player.tag[1:])
+                sql = "INSERT INTO uw_push_history (player_tag, trophies, taken_at) VALUES ($1, $2, $3)"
+                await conn.execute(sql, new_player.tag[1:], new_player.trophies, datetime.utcnow())
+        self.leaderboard_stale = True
+        self.rank_player(new_player.tag[1:], score, new_player.town_hall)
+        self.stats.update(new_player.tag[1:], new_player.trophies)
+        self.stats.updated = datetime.utcnow()
+
+    async def write_trophies(self, updates):
+        """Apply (player_tag, trophies, th_level) updates in a single transaction
+
+        Rows are written `batch_size` at a time with one set-based statement per batch.
+        A th_level of None leaves the stored TH level alone. Players whose trophies moved
+        get a point in uw_push_history. Since everything commits together, the leaderboard
+        is never seen half updated.
+        """
+        if not updates:
+            return
+        tags, trophies, th_levels = zip(*updates)
+        known = [th if th is not None else self.th_levels.get(tag) for tag, _, th in updates]
+        scores = self.rules.scores(known, trophies)
+        sql = ("UPDATE uw_push_1 AS p "
+               "SET current_trophies = x.trophies, th_level = COALESCE(x.th_level, p.th_level), score = x.score "
+               "FROM unnest($1::text[], $2::int[], $3::int[], $4::int[]) AS x(player_tag, trophies, th_level, score) "
+               "WHERE p.player_tag = x.player_tag")
+        # runs first so it can compare against the trophies being replaced
+        history_sql = ("INSERT INTO uw_push_history (player_tag, trophies, taken_at) "
+                       "SELECT x.player_tag, x.trophies, $3 "
+                       "FROM unnest($1::text[], $2::int[]) AS x(player_tag, trophies) "
+                       "JOIN uw_push_1 AS p ON p.player_tag = x.player_tag "
+                       "WHERE p.current_trophies IS DISTINCT FROM x.trophies")
+        now = datetime.utcnow()
+        async with self.bot.pool.acquire() as conn:
+            async with conn.transaction():
+                for i in range(0, len(updates), self.batch_size):
+                    batch = slice(i, i + self.batch_size)
+                    await conn.execute(history_sql, tags[batch], trophies[batch], now)
+                    await conn.execute(sql, tags[batch], trophies[batch], th_levels[batch], scores[batch])
+        for tag, score, th_level, trophy_count in zip(tags, scores, th_levels, trophies):
+            self.rank_player(tag, score, th_level)
+            self.stats.update(tag, trophy_count)
+        self.stats.updated = now
+
+    async def load_ranks(self):
+        sql = ("SELECT player_tag, player_name, score, th_level, starting_trophies, current_trophies "
+               "FROM uw_push_1")
+        fetch = await self.bot.pool.fetch(sql)
+        self.ranks.clear()
+        self.th_levels = {}
+        self.stats.clear()
+        for row in fetch:
+            self.rank_player(row['player_tag'], row['score'], row['th_level'], row['player_name'])
+            self.stats.update(row['player_tag'], row['current_trophies'],
+                              starting=row['starting_trophies'], name=row['player_name'])
+        self.stats.updated = datetime.utcnow()
+
+    def rank_player(self, tag, score, th_level=None, name=None):
+        """Move a player (tag without #) in the rank index. A th_level of None keeps the known one."""
+        if th_level is not None:
+            self.th_levels[tag] = th_level
+        if score is None:
+            self.ranks.remove(tag)
+        else:
+            self.ranks.update(tag, score, name)
+
+    async def rescore(self, *, missing_only=False):
+        """Load this event's scoring rules and recompute the stored scores with them
+
+        With missing_only, only rows without a score are worked out, which fills in
+        rows written before there was a score column.
+        """
+        conn = self.bot.pool
+        self.rules = await ScoringRules.load(conn, self.event_id)
+        sql = "SELECT player_tag, current_trophies, th_level FROM uw_push_1"
+        if missing_only:
+            sql += " WHERE score IS NULL"
+        fetch = await conn.fetch(sql)
+        if fetch:
+            tags = [row['player_tag'] for row in fetch]
+            scores = self.rules.scores([row['th_level'] for row in fetch],
+                                       [row['current_trophies'] for row in fetch])
+            sql = ("UPDATE uw_push_1 AS p SET score = x.score "
+                   "FROM unnest($1::text[], $2::int[]) AS x(player_tag, score) "
+                   "WHERE p.player_tag = x.player_tag AND p.score IS DISTINCT FROM x.score")
+            await conn.execute(sql, tags, scores)
+        await self.refresh_leaderboard()
+        await self.load_ranks()
+
+    async def refresh_leaderboard(self):
+        conn = self.bot.pool
+        # clan totals are built from the leaderboard, so it has to go first
+        await conn.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY uw_push_leaderboard")
+        await conn.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY uw_push_clan_totals")
+        self.leaderboard_stale = False
+
+    @tasks.loop(minutes=5.0)
+    async def refresh_stale_leaderboard(self):
+        """In events mode trophies change between update cycles, so catch the leaderboard up"""
+        if self.leaderboard_stale:
+            await self.refresh_leaderboard()
+
+    @refresh_stale_leaderboard.before_loop
+    async def before_refresh_stale_leaderboard(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(hours=1.0)
+    async def compact_history(self):
+        """Downsample old uw_push_history points to the resolutions in HISTORY_RESOLUTION"""
+        now = datetime.utcnow()
+        sql = ("DELETE FROM uw_push_history "
+               "WHERE taken_at < $1 AND id NOT IN ("
+               "  SELECT DISTINCT ON (player_tag, date_trunc($2, taken_at)) id "
+               "  FROM uw_push_history "
+               "  WHERE taken_at < $1 "
+               "  ORDER BY player_tag, date_trunc($2, taken_at), taken_at DESC"
+               ")")
+        for age, bucket in HISTORY_RESOLUTION:
+            status = await self.bot.pool.execute(sql, now - age, bucket)
+            self.bot.logger.debug(f"Push history: thinned {status.split()[-1]} points "
+                                  f"older than {age} to one per {bucket}")
+
+    @compact_history.before_loop
+    async def before_compact_history(self):
+        await self.bot.wait_until_ready()
 
     @tasks.loop(minutes=10.0)
     async def update_push(self):
-        """Update trophy count and TH level"""
-        now = datetime.utcnow()
-        if self.start_time < now < self.end_time:
-            conn = self.bot.pool
+        """Update trophy count and TH level
+
+        Trophies come from the clan rosters every cycle. Full player profiles, which are
+        needed for TH level, are only fetched every `profile_cycles` cycles or for players
+        that are no longer in a UW clan.
+        """
+        if self.event and datetime.utcnow() > self.event['end_time']:
+            await self.close_event()
+        if not self.event:
+            # sleeps here, costing nothing, until the next push window opens
+            await self.open_event(await self.bot.calendar.wait_for_event(TROPHY_PUSH))
+        conn = self.bot.pool
+        if self.participants is None:
             sql = "SELECT player_tag FROM uw_push_1"
             fetch = await conn.fetch(sql)
-            player_list = ["#" + x['player_tag'] for x in fetch]
-            sql = "UPDATE uw_push_1 SET current_trophies = $1, th_level = $2 WHERE player_tag = $3"
-            async for player in self.bot.coc.get_players(player_list):
-                await conn.execute(sql, player.trophies, player.town_hall, player.tag[1:])
-            new_player_list = []
-            async for clan in self.bot.coc.get_clans(clans):
-                for member in clan.itermembers:
-                    if member.tag not in player_list:
-                        new_player_list.append(member.tag)
-            to_insert = []
-            counter = 1
-            async for player in self.bot.coc.get_players(new_player_list):
-                to_insert.append((counter,
-                                  player.tag[1:],
-                                  player.name.replace("'", "''"),
-                                  player.clan.tag[1:],
-                                  player.clan.name,
-                                  player.trophies if player.trophies <= 5000 else 5000,
-                                  player.trophies if player.trophies <= 5000 else 5000,
-                                  player.best_trophies,
-                                  player.town_hall
-                                  ))
-                counter += 1
-            sql = ("INSERT INTO uw_push_1 (player_tag, player_name, clan_tag, clan_name, "
-                   "starting_trophies, current_trophies, best_trophies, th_level) "
-                   "SELECT x.player_tag, x.player_name, x.clan_tag, x.clan_name, x.starting_trophies, "
-                   "x.current_trophies, x.best_trophies, x.th_level "
-                   "FROM unnest($1::uw_push_1[]) as x")
-            await conn.execute(sql, to_insert)
+            self.participants = {"#" + x['player_tag'] for x in fetch}
+        player_list = list(self.participants)
+        fetched_rosters = await self.bot.rosters.refresh(max_age=timedelta(minutes=2))
+        roster = {}
+        for clan in self.bot.rosters.clans.values():
+            for member in clan.itermembers:
+                roster[member.tag] = member
+        updates = {}
+        full_refresh = self.cycles_since_profiles >= self.profile_cycles
+        if full_refresh:
+            self.cycles_since_profiles = 0
+            profile_list = player_list
+        else:
+            self.cycles_since_profiles += 1
+            profile_list = [tag for tag in player_list if tag not in roster]
+            for tag in player_list:
+                if tag in roster:
+                    updates[tag[1:]] = (tag[1:], roster[tag].trophies, None)
+        players = []
+        async for player in self.bot.coc.get_players(profile_list):
+            updates[player.tag[1:]] = (player.tag[1:], player.trophies, player.town_hall)
+            players.append(player)
+        await self.write_trophies(list(updates.values()))
+        new_player_list = list(self.joined - self.participants)
+        self.joined.clear()
+        new_players = []
+        async for player in self.bot.coc.get_players(new_player_list):
+            # joiners are fetched up to a cycle later, by which time they may have left again
+            if player.clan and player.clan.tag in self.bot.clan_registry:
+                new_players.append(player)
+        await bulk_insert(conn, "uw_push_1", PUSH_COLUMNS,
+                          (push_record(player, self.rules, self.event_id) for player in new_players),
+                          keys=("player_tag",))
+        self.participants.update(player.tag for player in new_players)
+        for player in new_players:
+            row = dict(zip(PUSH_COLUMNS, push_record(player, self.rules, self.event_id)))
+            self.rank_player(row['player_tag'], row['score'], row['th_level'], row['player_name'])
+            self.stats.update(row['player_tag'], row['current_trophies'],
+                              starting=row['starting_trophies'], name=row['player_name'])
+        players.extend(new_players)
+        await upsert_players(conn, players)
+        self.bot.players.update_players(players)
+        if self.use_events:
+            self.bot.player_updates.add("push", *[player.tag for player in players])
+        await self.refresh_leaderboard()
+        clan_count = len(self.bot.clan_registry)
+        # a roster fetch made shortly before by the tracker's own loop is reused for free
+        api_calls = (clan_count if fetched_rosters else 0) + len(profile_list) + len(new_player_list)
+        every_profile = clan_count + len(player_list) + len(new_player_list)
+        self.bot.logger.debug(f"Push update: {api_calls} API calls "
+                              f"(fetching every profile would take {every_profile})"
+                              f"{', full profile refresh' if full_refresh else ''}")
+
+    @update_push.before_loop
+    async def before_update_push(self):
+        await self.bot.wait_until_ready()
+        await self.bot.pool.execute(SCHEMA_SQL)
+        # the standings stay available between events, scored by the latest push's rules
+        await self.bot.calendar.wait_until_loaded()
+        event = self.bot.calendar.current(TROPHY_PUSH) or self.bot.calendar.latest(TROPHY_PUSH)
+        self.event_id = event['event_id'] if event else None
+        finished = self.bot.calendar.last(TROPHY_PUSH)
+        if finished:
+            # rows from before the event_id column can't be told apart, so they're put down to
+            # the last finished push; if a new one is running, open_event then archives them
+            await self.bot.pool.execute("UPDATE uw_push_1 SET event_id = $1 WHERE event_id IS NULL",
+                                        finished['event_id'])
+        await self.rescore(missing_only=True)
+
+    async def open_event(self, event):
+        self.event = event
+        self.event_id = event['event_id']
+        self.cycles_since_profiles = self.profile_cycles
+        count, elapsed = await self.start_event()
+        self.bot.logger.info(f"Push event {self.event_id} is open until {event['end_time']:%d %b %H:%M} UTC, "
+                             f"{count} players added in {elapsed:.1f} seconds")
+
+    async def start_event(self, *, reset=False):
+        """Record every UW member's starting trophies for the current push
+
+        Rows left over from earlier pushes are archived first. Players already entered
+        in this push keep their starting trophies (so a restart mid-push changes nothing)
+        unless reset, which starts the push over for everyone.
+        Returns the number of players added and how long it took.
+        """
+        start = time.perf_counter()
+        await self.bot.clan_registry.wait_until_loaded()
+        clans = await fetch_clans(self.bot.coc, self.bot.clan_registry.tags)
+        members = [member.tag for clan in clans.values() for member in clan.members]
+        players = [player for player in (await fetch_players(self.bot.coc, members)).values() if player.clan]
+        self.rules = await ScoringRules.load(self.bot.pool, self.event_id)
+        async with self.bot.pool.acquire() as conn:
+            async with conn.transaction():
+                sql = ("INSERT INTO uw_push_archive (event_id, player_tag, player_name, clan_tag, clan_name, "
+                       "starting_trophies, current_trophies, best_trophies, th_level, score) "
+                       "SELECT event_id, player_tag, player_name, clan_tag, clan_name, "
+                       "starting_trophies, current_trophies, best_trophies, th_level, score "
+                       "FROM uw_push_1 WHERE event_id IS DISTINCT FROM $1")
+                await conn.execute(sql, self.event_id)
+                if reset:
+                    await conn.execute("DELETE FROM uw_push_1")
+                    await conn.execute("DELETE FROM uw_push_history")
+                else:
+                    await conn.execute("DELETE FROM uw_push_1 WHERE event_id IS DISTINCT FROM $1", self.event_id)
+                    await conn.execute("DELETE FROM uw_push_history WHERE taken_at < $1", self.event['start_time'])
+        count = await bulk_insert(self.bot.pool, "uw_push_1", PUSH_COLUMNS,
+                                  (push_record(player, self.rules, self.event_id) for player in players),
+                                  keys=("player_tag",))
+        await upsert_players(self.bot.pool, players)
+        self.bot.players.update_players(players)
+        # reloaded from the table on the next update
+        self.participants = None
+        self.joined.clear()
+        await self.rescore()
+        return count, time.perf_counter() - start
+
+    async def close_event(self):
+        """Stop tracking once the push window has closed, leaving the final standings in place"""
+        if self.leaderboard_stale:
+            await self.refresh_leaderboard()
+        if self.use_events:
+            self.bot.player_updates.remove_all("push")
+        self.joined.clear()
+        self.bot.logger.info(f"Push event {self.event_id} is over")
+        self.event = None
+
+    @commands.Cog.listener()
+    async def on_roster_join(self, tag, clan):
+        # picked up by the next update_push cycle
+        self.joined.add(tag)
 
     @commands.group(name="push",  invoke_without_command=True)
     async def push(self, ctx):
@@ -71,37 +418,13 @@ class Push(commands.Cog):
     @push.command(name="start", hidden=True)
     @commands.is_owner()
     async def push_start(self, ctx):
-        now = datetime.utcnow()
-        # if self.start_time - timedelta(minutes=3) < now < self.start_time + timedelta(minutes=30):
+        """Start the current push over, taking everyone's starting trophies again"""
+        if not self.event:
+            return await ctx.send("There is no push running right now.")
         msg = await ctx.send("Starting push start...")
-        start = time.perf_counter()
-        player_list = []
-        async for clan in self.bot.coc.get_clans(clans):
-            for member in clan.itermembers:
-                player_list.append(member.tag)
-        to_insert = []
-        counter = 1
-        async for player in self.bot.coc.get_players(player_list):
-            to_insert.append((counter,
-                              player.tag[1:],
-                              player.name.replace("'", "''"),
-                              player.clan.tag[1:],
-                              player.clan.name,
-                              player.trophies if player.trophies <= 5000 else 5000,
-                              player.trophies if player.trophies <= 5000 else 5000,
-                              player.best_trophies,
-                              player.town_hall
-                              ))
-            counter += 1
-        conn = self.bot.pool
-        sql = ("INSERT INTO uw_push_1 (player_tag, player_name, clan_tag, clan_name, "
-               "starting_trophies, current_trophies, best_trophies, th_level) "
-               "SELECT x.player_tag, x.player_name, x.clan_tag, x.clan_name, x.starting_trophies, "
-               "x.current_trophies, x.best_trophies, x.th_level "
-               "FROM unnest($1::uw_push_1[]) as x")
-        await conn.execute(sql, to_insert)
+        count, elapsed = await self.start_event(reset=True)
         await msg.delete()
-        await ctx.send(f"Elapsed time: {(time.perf_counter() - start) / 60:.2f} minutes")
+        await ctx.send(f"{count} players added. Elapsed time: {elapsed / 60:.2f} minutes")
         # # Announce the start
         # embed = discord.Embed(title="UW Trophy Push has begun", color=discord.Color.green())
         # embed.add_field(name="Start Time", value="May 25 - 5am UTC", inline=True)
@@ -113,40 +436,74 @@ class Push(commands.Cog):
         # bot_channel = self.bot.get_channel(settings['channels']['uw_bot'])
         # await bot_channel.send()
 
+    @push.command(name="scoring", hidden=True)
+    @commands.is_owner()
+    async def push_scoring(self, ctx, th_level: int, trophy_offset: int):
+        """Set the trophy offset for a TH level and rescore everyone
+
+        Example:
+        +push scoring 13 5000"""
+        await self.bot.calendar.wait_until_loaded()
+        event = self.bot.calendar.current(TROPHY_PUSH) or self.bot.calendar.next(TROPHY_PUSH)
+        if not event:
+            return await ctx.send("There is no push running or scheduled.")
+        conn = self.bot.pool
+        # the first stored rule replaces the defaults, so store those alongside it
+        sql = ("INSERT INTO uw_push_scoring (event_id, th_level, trophy_offset) "
+               "SELECT $1, x.th_level, x.trophy_offset "
+               "FROM unnest($2::int[], $3::int[]) AS x(th_level, trophy_offset) "
+               "ON CONFLICT (event_id, th_level) DO UPDATE SET trophy_offset = excluded.trophy_offset")
+        rules = await ScoringRules.load(conn, event['event_id'])
+        offsets = dict(rules.offsets)
+        offsets[th_level] = trophy_offset
+        await conn.execute(sql, event['event_id'], list(offsets), list(offsets.values()))
+        rules = ScoringRules(offsets)
+        if event['event_id'] == self.event_id:
+            await self.rescore()
+        await ctx.send(f"Push scoring is now:\n{rules.describe()}")
+
     @push.command(name="info")
     async def push_info(self, ctx):
         """Provides information on the push event."""
         now = datetime.utcnow()
-        conn = self.bot.pool
-        sql = ("SELECT COUNT(*) AS num_players, MAX(current_trophies) AS max_trophies, "
-               "MAX(current_trophies - starting_trophies) AS max_gain FROM uw_push_1")
-        fetch = await conn.fetchrow(sql)
-        player_count = fetch['num_players']
-        clan_count = len(clans)
-        max_trophies = fetch['max_trophies']
-        max_gain = fetch['max_gain']
-        if now < self.start_time:
-            delta = (self.start_time - now)
+        player_count = len(self.stats)
+        clan_count = len(self.bot.clan_registry)
+        max_trophies = self.stats.max_trophies
+        max_gain = self.stats.max_gain
+        await self.bot.calendar.wait_until_loaded()
+        event = (self.bot.calendar.current(TROPHY_PUSH) or self.bot.calendar.next(TROPHY_PUSH)
+                 or self.bot.calendar.last(TROPHY_PUSH))
+        if not event:
+            return await ctx.send("There is no trophy push on the calendar.")
+        start_time = event['start_time']
+        end_time = event['end_time']
+        if now < start_time:
+            delta = (start_time - now)
             print(delta)
             days = delta.days
             hours, rem = divmod(delta.seconds, 3600)
             mins, rem = divmod(rem, 60)
             print(days, hours, mins)
             time_field_name = "Start Time"
-            time_field_value = self.start_time.strftime("%d %b %Y %H:%M")
+            time_field_value = start_time.strftime("%d %b %Y %H:%M")
             if days > 0:
                 left_field_name = "Until Start"
                 left_field_value = f"{days} days, {hours} hours"
             else:
                 left_field_name = "Until Start"
                 left_field_value = f"{hours} hours, {mins} minutes"
+        elif now > end_time:
+            time_field_name = "End Time"
+            time_field_value = end_time.strftime("%d %b %Y %H:%M")
+            left_field_name = "Time Left"
+            left_field_value = "Finished"
         else:
-            delta = (self.end_time - now)
+            delta = (end_time - now)
             days = delta.days
             hours, rem = divmod(delta.seconds, 3600)
             mins, rem = divmod(rem, 60)
             time_field_name = "End Time"
-            time_field_value = self.end_time.strftime("%d %b %Y %H:%M")
+            time_field_value = end_time.strftime("%d %b %Y %H:%M")
             if days > 0:
                 left_field_name = "Time Left"
                 left_field_value = f"{days} days, {hours} hours"
@@ -157,29 +514,25 @@ class Push(commands.Cog):
         embed.add_field(name="Clans", value=str(clan_count), inline=True)
         embed.add_field(name="Players", value=str(player_count), inline=True)
         embed.add_field(name=time_field_name, value=time_field_value, inline=True)
-        embed.add_field(name="Highest Trophies", value=str(max_trophies), inline=True)
-        # embed.add_field(name="Biggest Gain", value=str(max_gain), inline=True)
+        embed.add_field(name="Highest Trophies",
+                        value=f"{max_trophies[0]} ({max_trophies[1]})" if max_trophies else "-", inline=True)
+        embed.add_field(name="Biggest Gain",
+                        value=f"{max_gain[0]} ({max_gain[1]})" if max_gain else "-", inline=True)
         embed.add_field(name=left_field_name, value=left_field_value, inline=True)
-        embed.add_field(name="Point Structure", value="TH13 -5000\nTH12 -4000\nTH11 -3500\nTH10 -3000", inline=False)
+        embed.add_field(name="Point Structure", value=self.rules.describe(), inline=False)
         embed.set_thumbnail(url="http://www.mayodev.com/images/trophy2.png")
+        if self.stats.updated:
+            embed.set_footer(text=f"Last updated {self.stats.updated:%H:%M} UTC")
         await ctx.send(embed=embed)
 
     @push.command(name="top")
     async def push_top(self, ctx):
         """Returns the top 20 players"""
         conn = self.bot.pool
-        sql = ("SELECT "
-               "CASE th_level "
-               "WHEN 13 THEN current_trophies - 5000 "
-               "WHEN 12 THEN current_trophies - 4000 "
-               "WHEN 11 THEN current_trophies - 3500 "
-               "WHEN 10 THEN current_trophies - 3000 "
-               "ELSE 1 "
-               "END AS score, "
-               "player_name, th_level "
-               "FROM uw_push_1 "
-               "WHERE th_level > 9 "
-               "ORDER BY score DESC")
+        sql = ("SELECT score, player_name, th_level "
+               "FROM uw_push_leaderboard "
+               "WHERE rank <= 20 "
+               "ORDER BY rank")
         fetch = await conn.fetch(sql)
         ctx.icon = "https://cdn.discordapp.com/emojis/635642869738111016.png"
         p = formats.TopTenPaginator(ctx, data=fetch)
@@ -189,21 +542,43 @@ class Push(commands.Cog):
     async def push_all(self, ctx):
         """Return all players"""
         conn = self.bot.pool
-        sql = ("SELECT "
-               "CASE th_level "
-               "WHEN 13 THEN current_trophies - 5000 "
-               "WHEN 12 THEN current_trophies - 4000 "
-               "WHEN 11 THEN current_trophies - 3500 "
-               "WHEN 10 THEN current_trophies - 3000 "
-               "ELSE 1 "
-               "END AS score, "
-               "player_name, th_level "
-               "FROM uw_push_1 "
-               "WHERE th_level > 9 "
-               "ORDER BY score DESC")
-        fetch = await conn.fetch(sql)
+        per_page = 25
+        total = await conn.fetchval("SELECT COALESCE(MAX(rank), 0) FROM uw_push_leaderboard")
+
+        async def fetch_page(page):
+            # rank numbers the (score, player_tag) ordering, so this is a seek on its index
+            # and a deep page costs the same as the first one
+            sql = ("SELECT score, player_name, th_level "
+                   "FROM uw_push_leaderboard "
+                   "WHERE rank > $1 "
+                   "ORDER BY rank "
+                   "LIMIT $2")
+            return await conn.fetch(sql, (page - 1) * per_page, per_page)
+
         ctx.icon = "https://cdn.discordapp.com/emojis/635642869738111016.png"
-        p = formats.TablePaginator(ctx, data=fetch, title="All players", page_count=4)
+        p = formats.LazyTablePaginator(ctx, fetch_page, total, title="All players", rows_per_table=per_page)
+        await p.paginate()
+
+    @push.command(name="gain")
+    async def push_gain(self, ctx, hours: int = 24):
+        """Returns the players who gained the most trophies recently
+
+        Examples:
+        +push gain
+        +push gain 6"""
+        conn = self.bot.pool
+        sql = ("SELECT p.current_trophies - COALESCE(h.trophies, p.starting_trophies) AS gain, p.player_name "
+               "FROM uw_push_1 AS p "
+               "LEFT JOIN LATERAL ("
+               "  SELECT trophies FROM uw_push_history "
+               "  WHERE player_tag = p.player_tag AND taken_at <= $1 "
+               "  ORDER BY taken_at DESC LIMIT 1"
+               ") AS h ON TRUE "
+               "ORDER BY gain DESC "
+               "LIMIT 25")
+        fetch = await conn.fetch(sql, datetime.utcnow() - timedelta(hours=hours))
+        ctx.icon = "https://cdn.discordapp.com/emojis/635642869738111016.png"
+        p = formats.TablePaginator(ctx, data=fetch, title=f"Biggest gains in the last {hours} hours")
         await p.paginate()
 
     @push.command(name="player", aliases=["p"])
@@ -217,7 +592,11 @@ class Push(commands.Cog):
         +push p #8GQPJG2CL"""
         if not player:
             return await ctx.send("Please provide a player name or a player tag")
-        fetch = await get_neighbors(player.tag)
+        tag = player.tag[1:]
+        if tag in self.ranks:
+            fetch = [(score, name) for _, score, name, _ in self.ranks.neighbors(tag)]
+        else:
+            fetch = await get_neighbors(self.bot.pool, player.tag)
         ctx.icon = "https://cdn.discordapp.com/emojis/635642869738111016.png"
         p = formats.TablePaginator(ctx, data=fetch, title="Nearby players")
         await p.paginate()
@@ -234,8 +613,8 @@ class Push(commands.Cog):
         if not clan:
             return await ctx.send("Please provide a clan name or clan tag")
         conn = self.bot.pool
-        sql = ("SELECT score, player_name FROM uw_push "
-               "WHERE clan_tag = $1 ORDER BY score DESC")
+        sql = ("SELECT score, player_name FROM uw_push_leaderboard "
+               "WHERE clan_tag = $1 ORDER BY rank")
         fetch = await conn.fetch(sql, clan.tag[1:])
         ctx.icon = "https://cdn.discordapp.com/emojis/635642869738111016.png"
         p = formats.TablePaginator(ctx, data=fetch, title=clan.name, page_count=2, rows_per_table=25)
@@ -245,9 +624,8 @@ class Push(commands.Cog):
     async def push_clans(self, ctx):
         """Displays the ranking of clans based on total scores"""
         conn = self.bot.pool
-        sql = ("SELECT SUM(score) as total, clan_name FROM uw_push "
-               "GROUP BY clan_name "
-               "ORDER BY total DESC")
+        sql = ("SELECT total, clan_name FROM uw_push_clan_totals "
+               "ORDER BY rank")
         fetch = await conn.fetch(sql)
         ctx.icon = "https://cdn.discordapp.com/emojis/635642869738111016.png"
         p = formats.TablePaginator(ctx, data=fetch, title="All Clans", page_count=1, rows_per_table=20)
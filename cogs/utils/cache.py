@@ -1,31 +1,44 @@
-import asyncpg
+# Run on the bot's pool rather than a connection per call. asyncpg prepares each
+# statement once per pooled connection and reuses it from its statement cache,
+# so a repeat call is a single round trip.
+NEIGHBORS_SQL = ("SELECT score, player_name, player_tag, rank AS row_num "
+                 "FROM uw_push_leaderboard "
+                 "WHERE rank BETWEEN "
+                 "(SELECT rank - 5 FROM uw_push_leaderboard WHERE player_tag = $1) AND "
+                 "(SELECT rank + 5 FROM uw_push_leaderboard WHERE player_tag = $1) "
+                 "ORDER BY rank")
 
-from config import settings
+DATA_SQL = "SELECT player_name, player_tag, clan_name, clan_tag FROM uw_push_1 ORDER BY player_name"
 
 
-async def get_neighbors(player_tag):
+async def get_neighbors(pool, player_tag):
     """Retrieve the nearest 5 neighbors from the provided player, sorted by score"""
-    conn = await asyncpg.connect(f"{settings['pg']['uri_home']}")
-    sql = ("WITH cte AS ("
-           "SELECT score, player_name, player_tag, ROW_NUMBER() OVER (ORDER BY score DESC) AS row_num "
-           "FROM uw_push "
-           "), curr AS ( "
-           "SELECT row_num FROM cte "
-           "WHERE player_tag = $1 "
-           ") "
-           "SELECT cte.* "
-           "FROM cte, curr "
-           "WHERE ABS(cte.row_num - curr.row_num) <= 5 "
-           "ORDER BY cte.row_num")
-    fetch = await conn.fetch(sql, player_tag[1:])
-    await conn.close()
-    return fetch
-
-
-async def get_data():
-    """Retrieve all clans that are a part of UW"""
-    conn = await asyncpg.connect(f"{settings['pg']['uri_home']}")
-    sql = "SELECT player_name, player_tag, clan_name, clan_tag FROM uw_push_1 ORDER BY player_name"
-    fetch = await conn.fetch(sql)
-    await conn.close()
-    return fetch
+    return await pool.fetch(NEIGHBORS_SQL, player_tag[1:])
+
+
+async def get_data(pool):
+    """Retrieve all players taking part in the push"""
+    return await pool.fetch(DATA_SQL)
+
+
+async def upsert_players(conn, players):
+    """Record the current name and clan of each player in uw_players
+
+    Rows are only rewritten when the name or clan has actually changed.
+    """
+    if not players:
+        return
+    to_upsert = [(player.tag[1:],
+                  player.name,
+                  player.clan.tag[1:] if player.clan else None,
+                  player.clan.name if player.clan else None)
+                 for player in players]
+    tags, names, clan_tags, clan_names = zip(*to_upsert)
+    sql = ("INSERT INTO uw_players (player_tag, player_name, clan_tag, clan_name) "
+           "SELECT * FROM unnest($1::text[], $2::text[], $3::text[], $4::text[]) "
+           "ON CONFLICT (player_tag) DO UPDATE "
+           "SET player_name = excluded.player_name, clan_tag = excluded.clan_tag, "
+           "clan_name = excluded.clan_name, updated = NOW() AT TIME ZONE 'utc' "
+           "WHERE (uw_players.player_name, uw_players.clan_tag, uw_players.clan_name) "
+           "IS DISTINCT FROM (excluded.player_name, excluded.clan_tag, excluded.clan_name)")
+    await conn.execute(sql, tags, names, clan_tags, clan_names)
@@ -1,3 +1,5 @@
+# Only used to seed uw_clans the first time the clan registry loads. After that the
+# table is the list of UW clans; edit it and run +reload clans.
 clans = {
     "#U8R80VUR",
     "#RQGGLV20",
@@ -16,22 +18,3 @@ clans = {
     "#9YVY9C8J",
     "#22LCQJLG2",
 }
-
-clan_names = {
-    "Betatron",
-    "Potato’s Diner",
-    "Reddit Zero",
-    "!One Love!",
-    "Aussie Warriors",
-    "Under 8s Team",
-    "New Excalibur",
-    "Gobinluil",
-    "V.F RELOADED",
-    "Canadian Kings",
-    "Source of Logic",
-    "Reddit Hotel",
-    "squad",
-    "!Mini Love!",
-    "CrOsseyeCyclops",
-    "Unfair Warfare",
-}
\ No newline at end of file
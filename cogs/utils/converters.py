@@ -2,8 +2,6 @@ import coc
 import re
 
 from discord.ext import commands
-# from cogs.utils.cache import get_data
-from cogs.utils.constants import clans, clan_names
 
 
 tag_validator = re.compile("^#?[PYLQGRJCUV0289]+$")
@@ -15,58 +13,70 @@ class PlayerConverter(commands.Converter):
             return argument
 
         tag = coc.utils.correct_tag(argument)
-        name = argument.strip().lower()
+        index = ctx.bot.players
+        await index.wait_until_loaded()
 
-        if tag_validator.match(argument):
+        if tag_validator.match(argument) and tag[1:] in index:
             try:
-                for row in data:
-                    if row['player_tag'] == tag[1:]:
-                        return await ctx.coc.get_player(tag)
-                else:
-                    raise commands.BadArgument("Player not found in database. "
-                                               "Only UW members are listed in the database.")
+                return await ctx.coc.get_player(tag)
             except coc.NotFound:
                 raise commands.BadArgument("I detected a player tag; and couldn't "
                                            "find an account with that tag! "
                                            "If you didn't pass in a tag, "
                                            "please drop the owner a message.")
-        # if player_names.count(name) > 1:
-        #     indices = [i for i, x in enumerate(data) if x['player_name'].lower() == name]
-        #     print(indices)
-        #     prompt_text = f"Please select the appropriate {argument}:\n"
-        #     for index in indices:
-        #         prompt_text += f"{data[index]['player_name']} ({data[index]['player_tag']})\n"
-        #     prompt = await ctx.prompt(prompt_text, additional_options=player_names.count(name))
-        #     print(f"#{data[indices[prompt-1]]['player_tag']}")
-        #     return await ctx.coc.get_player(f"#{data[indices[prompt-1]]['player_tag']}")
-        for row in data:
-            if row['player_name'].lower() == name:
-                return await ctx.coc.get_player(f"#{row['player_tag']}")
-        raise commands.BadArgument("Invalid tag or in-game name.")
 
+        def describe(player_tag):
+            entry = index.get(player_tag)
+            return f"{entry['player_name']} (#{player_tag}) - {entry['clan_name']}"
+
+        tags = index.find(argument)
+        if not tags:
+            if tag_validator.match(argument):
+                raise commands.BadArgument("Player not found in database. "
+                                           "Only UW members are listed in the database.")
+            # fall back to names starting with what was typed, then to names that are close,
+            # to get past half-typed names, typos and emoji. These are only guesses, so the
+            # user always has to pick one.
+            tags = index.complete(argument, limit=5) or index.similar(argument)
+            if not tags:
+                raise commands.BadArgument("Invalid tag or in-game name.")
+            if len(tags) == 1:
+                if not await ctx.prompt(f"Did you mean {describe(tags[0])}?"):
+                    raise commands.BadArgument("Invalid tag or in-game name.")
+                return await ctx.coc.get_player(f"#{tags[0]}")
+
+        try:
+            player_tag = await ctx.disambiguate(tags, describe)
+        except ValueError as e:
+            raise commands.BadArgument(str(e))
+        return await ctx.coc.get_player(f"#{player_tag}")
 
 class ClanConverter(commands.Converter):
     async def convert(self, ctx, argument):
         # if argument == "all" or not argument:
         #     return await get_data()
-        if isinstance(argument, coc.Clan) and argument.tag in clans:
-            return [argument]
+        registry = ctx.bot.clan_registry
+        await registry.wait_until_loaded()
+        if isinstance(argument, coc.Clan) and argument.tag in registry:
+            return argument
 
-        tag = coc.utils.correct_tag(argument)
-        name = argument.strip().lower()
+        # names are checked first, a short clan name can also look like a tag
+        tag = registry.find(argument) or coc.utils.correct_tag(argument)
 
-        if tag_validator.match(tag):
+        if tag in registry:
+            # the roster refresh has usually fetched it already
+            clan = ctx.bot.rosters.clans.get(tag)
+            if clan:
+                return clan
             try:
-                if tag in clans:
-                    return await ctx.coc.get_clan(tag)
-                else:
-                    raise commands.BadArgument("Clan not found in database. "
-                                               "Only UW clans are listed in the database.")
+                return await ctx.coc.get_clan(tag)
             except coc.NotFound:
                 raise commands.BadArgument(f'{tag} is not a valid clan tag.')
-        if name in clan_names:
-            for tag in clans:
-                clan = await ctx.coc.get_clan(tag)
-                if clan.name == name:
-                    return clan
+        if tag_validator.match(tag):
+            raise commands.BadArgument("Clan not found in database. "
+                                       "Only UW clans are listed in the database.")
+        suggestions = [registry.get_name(tag) for tag in registry.complete(argument, 5)]
+        if suggestions:
+            raise commands.BadArgument(f'Clan name or tag `{argument}` not found. '
+                                       f'Did you mean {", ".join(suggestions)}?')
         raise commands.BadArgument(f'Clan name or tag `{argument}` not found')
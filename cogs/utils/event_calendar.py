@@ -0,0 +1,90 @@
+import asyncio
+
+from cogs.utils.loader import PeriodicLoader
+from datetime import datetime, timedelta
+
+# event_type_id values in rcs_events
+CLAN_GAMES = 1
+TROPHY_PUSH = 2
+
+
+class EventCalendar(PeriodicLoader):
+    """In-memory copy of rcs_events
+
+    Event windows only change a few times a month, so the table is loaded once
+    and reloaded on a slow schedule (or with `+reload events`). All of the
+    current/next/last questions are then answered without touching the DB.
+    Rows sharing an event_id are folded into one event spanning all of them.
+    """
+    description = "Event calendar"
+
+    def __init__(self, bot, *, hours=6):
+        self.events = []
+        # set (and replaced) on every load, to wake anything waiting on the schedule
+        self._reloaded = asyncio.Event()
+        super().__init__(bot, hours=hours)
+
+    async def load(self):
+        sql = ("SELECT event_id, event_type_id, MIN(start_time) AS start_time, MAX(end_time) AS end_time, "
+               "MAX(player_points) AS player_points, MAX(clan_points) AS clan_points "
+               "FROM rcs_events "
+               "GROUP BY event_id, event_type_id "
+               "ORDER BY start_time")
+        fetch = await self.bot.pool.fetch(sql)
+        self.events = [dict(row) for row in fetch]
+        reloaded, self._reloaded = self._reloaded, asyncio.Event()
+        reloaded.set()
+
+    async def wait_for_event(self, event_type_id, *, lead=timedelta()):
+        """Sleep until an event of this type is running (or starts within `lead`) and return it
+
+        Wakes up when the next event is due or when the calendar is reloaded, so
+        nothing is polled while there is no event on.
+        """
+        while True:
+            await self.wait_until_loaded()
+            now = datetime.utcnow()
+            event = self.current(event_type_id, now) or self.next(event_type_id, now)
+            if event and event['start_time'] - lead <= now:
+                return event
+            timeout = (event['start_time'] - lead - now).total_seconds() if event else None
+            try:
+                await asyncio.wait_for(self._reloaded.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _of_type(self, event_type_id):
+        return [event for event in self.events if event['event_type_id'] == event_type_id]
+
+    def get(self, event_id):
+        """Return the event with the given ID, or None"""
+        for event in self.events:
+            if event['event_id'] == event_id:
+                return event
+        return None
+
+    def current(self, event_type_id, now=None):
+        """Return the event that is running right now, or None"""
+        now = now or datetime.utcnow()
+        for event in self._of_type(event_type_id):
+            if event['start_time'] <= now <= event['end_time']:
+                return event
+        return None
+
+    def next(self, event_type_id, now=None):
+        """Return the next event to start, or None"""
+        now = now or datetime.utcnow()
+        upcoming = [event for event in self._of_type(event_type_id) if event['start_time'] > now]
+        return min(upcoming, key=lambda event: event['start_time'], default=None)
+
+    def last(self, event_type_id, now=None):
+        """Return the most recently finished event, or None"""
+        now = now or datetime.utcnow()
+        finished = [event for event in self._of_type(event_type_id) if event['end_time'] < now]
+        return max(finished, key=lambda event: event['end_time'], default=None)
+
+    def latest(self, event_type_id, now=None):
+        """Return the most recently started event, running or not, or None"""
+        now = now or datetime.utcnow()
+        started = [event for event in self._of_type(event_type_id) if event['start_time'] < now]
+        return max(started, key=lambda event: event['start_time'], default=None)
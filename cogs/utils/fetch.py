@@ -0,0 +1,43 @@
+import asyncio
+import coc
+
+# bot.py logs in with two keys at a throttle of 20 each, so 40 in flight
+# keeps both keys busy without queueing far ahead of the throttler
+FETCH_CONCURRENCY = 40
+
+
+async def fetch_players(client, tags, *, limit=FETCH_CONCURRENCY):
+    """Fetch player profiles concurrently with at most `limit` requests in flight
+
+    Key rotation and rate limiting are left to the coc client. Tags that no
+    longer exist are skipped. Returns a dict of the tags as given -> Player.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def fetch(tag):
+        async with semaphore:
+            try:
+                return await client.get_player(tag)
+            except coc.NotFound:
+                return None
+
+    results = await asyncio.gather(*(fetch(tag) for tag in tags))
+    return {tag: player for tag, player in zip(tags, results) if player}
+
+
+async def fetch_clans(client, tags, *, limit=FETCH_CONCURRENCY):
+    """Fetch clans concurrently with at most `limit` requests in flight
+
+    Returns a dict of the tags as given -> Clan.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def fetch(tag):
+        async with semaphore:
+            try:
+                return await client.get_clan(tag)
+            except coc.NotFound:
+                return None
+
+    results = await asyncio.gather(*(fetch(tag) for tag in tags))
+    return {tag: clan for tag, clan in zip(tags, results) if clan}
@@ -1,5 +1,7 @@
+import math
 import textwrap
 
+from collections import OrderedDict
 from cogs.utils.paginator import Pages
 from config import emojis
 
@@ -120,7 +122,8 @@ class CLYTable:
         fmt = f"{emojis['other']['num']}`⠀{category:\u00A0>6.6}⠀` `⠀{'Name':\u00A0>22.22}⠀`\n"
         for v in self._rows:
             index = int(v[0]) + 1
-            index = emojis['level'][index]  # if index <= 100 else misc['idle']
+            # there are only level emojis up to 100
+            index = emojis['level'][index] if index <= 100 else f"`{index:\u00A0>3}`"
             fmt += f"{index}`⠀{str(v[1]):\u00A0>6.6}⠀` `⠀{str(v[2]):\u00A0>22.22}⠀`\n"
         return fmt
 
@@ -233,6 +236,46 @@ class TablePaginator(Pages):
             await self.message.add_reaction(reaction)
 
 
+class LazyTablePaginator(TablePaginator):
+    """TablePaginator that loads each page from the DB when it is shown
+
+    `fetch_page(page)` is awaited for the rows of a page, so only pages someone
+    actually looks at are loaded. Only the last `cached_pages` rendered pages
+    are kept for flipping back and forth.
+    """
+    def __init__(self, ctx, fetch_page, total, title=None, rows_per_table=25, cached_pages=2):
+        page_count = max(math.ceil(total / rows_per_table), 1)
+        super().__init__(ctx, data=[], title=title, page_count=page_count, rows_per_table=rows_per_table)
+        self.fetch_page = fetch_page
+        self.cached_pages = cached_pages
+        self.cache = OrderedDict()
+
+    async def get_page(self, page):
+        if page in self.cache:
+            self.cache.move_to_end(page)
+            return self.cache[page]
+
+        if not self.message:
+            self.message = await self.channel.send('Loading...')
+        else:
+            await self.message.edit(content='Loading...', embed=None)
+
+        entry = await self.prepare_entry(page)
+        self.cache[page] = entry
+        if len(self.cache) > self.cached_pages:
+            self.cache.popitem(last=False)
+        return entry
+
+    async def prepare_entry(self, page):
+        self.table.clear_rows()
+        base = (page - 1) * self.rows_per_table
+        for n in enumerate(await self.fetch_page(page), base):
+            self.create_row(n)
+
+        render = get_render_type(self.table, self.type_)
+        return render
+
+
 class TopTenPaginator(TablePaginator):
     def __init__(self, ctx, data):
         super().__init__(ctx, data, title=None, page_count=1, rows_per_table=20)
@@ -0,0 +1,112 @@
+import heapq
+import unicodedata
+
+from collections import Counter
+
+
+def normalize(text):
+    """Fold a name down to what people can actually type
+
+    Accents are stripped, case is folded and anything that isn't a letter or
+    digit (emoji, symbols, clan decorations) is dropped.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if c.isalnum()).casefold()
+
+
+def trigrams(text):
+    text = normalize(text)
+    if not text:
+        # names that are all emoji/punctuation would otherwise all share the padding trigram
+        return set()
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Fuzzy name matching on shared trigrams
+
+    Every name is broken into trigrams and an inverted index maps each trigram
+    to the keys having it, so a search only touches names that share at least
+    one trigram with the query. Keys can be added, renamed and removed one at
+    a time.
+    """
+    def __init__(self):
+        # trigram -> set of keys
+        self._postings = {}
+        # key -> set of trigrams
+        self._grams = {}
+
+    def __len__(self):
+        return len(self._grams)
+
+    def add(self, key, text):
+        """Index text under key, replacing whatever key had before"""
+        self.remove(key)
+        grams = trigrams(text)
+        self._grams[key] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        grams = self._grams.pop(key, None)
+        if grams is None:
+            return
+        for gram in grams:
+            keys = self._postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self._postings[gram]
+
+    def search(self, text, k=5, threshold=0.3):
+        """Return up to k (similarity, key) pairs, best first
+
+        Similarity is the Dice coefficient of the two trigram sets, from 0 to 1.
+        """
+        grams = trigrams(text)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            keys = self._postings.get(gram)
+            if keys:
+                shared.update(keys)
+        size = len(grams)
+        scored = ((2 * count / (size + len(self._grams[key])), key) for key, count in shared.items())
+        return heapq.nlargest(k, (pair for pair in scored if pair[0] >= threshold))
+
+
+if __name__ == "__main__":
+    # python -m cogs.utils.fuzzy
+    import random
+    import string
+    import time
+
+    random.seed(0)
+    alphabet = string.ascii_letters + string.digits + "éü★"
+
+    def fake_name():
+        return "".join(random.choice(alphabet) for _ in range(random.randint(4, 15)))
+
+    for size in (10_000, 100_000):
+        names = [fake_name() for _ in range(size)]
+        index = TrigramIndex()
+        start = time.perf_counter()
+        for key, name in enumerate(names):
+            index.add(key, name)
+        build = time.perf_counter() - start
+        # queries are real names with a typo in them
+        queries = []
+        for name in random.sample(names, 1000):
+            i = random.randrange(len(name))
+            queries.append(name[:i] + random.choice(string.ascii_lowercase) + name[i + 1:])
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query)
+        per_query = (time.perf_counter() - start) / len(queries)
+        start = time.perf_counter()
+        for key in range(100):
+            index.add(key, fake_name())
+        rename = (time.perf_counter() - start) / 100
+        print(f"{size:>7} names: build {build:.2f}s, search {per_query * 1000:.3f}ms, "
+              f"rename {rename * 1_000_000:.1f}us")
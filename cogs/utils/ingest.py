@@ -0,0 +1,31 @@
+import itertools
+
+CHUNK_SIZE = 500
+
+
+async def bulk_insert(pool, table, columns, records, *, keys, chunk_size=CHUNK_SIZE):
+    """Stream records into table with COPY, skipping rows whose keys are already there
+
+    `records` can be any iterable of tuples matching `columns`; a generator keeps
+    memory flat since only `chunk_size` rows are built at a time. They are copied
+    into a temporary table and merged into `table` in one statement, so running
+    the same ingest twice adds nothing. Returns the number of rows inserted.
+    """
+    staging = f"_ingest_{table}"
+    column_list = ", ".join(columns)
+    match = " AND ".join(f"t.{key} = s.{key}" for key in keys)
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+                               f"SELECT {column_list} FROM {table} WITH NO DATA")
+            records = iter(records)
+            while True:
+                chunk = list(itertools.islice(records, chunk_size))
+                if not chunk:
+                    break
+                await conn.copy_records_to_table(staging, records=chunk, columns=columns)
+            status = await conn.execute(f"INSERT INTO {table} ({column_list}) "
+                                        f"SELECT DISTINCT ON ({', '.join(keys)}) {column_list} FROM {staging} s "
+                                        f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match}) "
+                                        f"ON CONFLICT DO NOTHING")
+    return int(status.split()[-1])
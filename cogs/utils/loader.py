@@ -0,0 +1,52 @@
+import asyncio
+import asyncpg
+
+from datetime import datetime
+
+
+class PeriodicLoader:
+    """Base for the in-memory copies of DB tables the bot keeps (calendar, clans, players)
+
+    Subclasses implement `load()`. It runs once the bot is ready and then every
+    `hours`. Until the first load succeeds everything waiting in
+    `wait_until_loaded()` is stuck, so a failed first load is retried on a short
+    backoff; after that a failed reload just keeps the last good copy.
+    """
+    #: used in the log message when a load fails
+    description = "Data"
+
+    def __init__(self, bot, *, hours):
+        self.bot = bot
+        self.interval = hours * 3600
+        self.loaded_at = None
+        self._loaded = asyncio.Event()
+        self._task = bot.loop.create_task(self._refresh())
+
+    def close(self):
+        self._task.cancel()
+
+    async def wait_until_loaded(self):
+        await self._loaded.wait()
+
+    async def load(self):
+        raise NotImplementedError
+
+    async def reload(self):
+        """Load now, outside of the schedule (e.g. for the `+reload` commands)"""
+        await self.load()
+        self.loaded_at = datetime.utcnow()
+        self._loaded.set()
+
+    async def _refresh(self):
+        await self.bot.wait_until_ready()
+        delay = 5
+        while True:
+            try:
+                await self.reload()
+            except (asyncpg.PostgresError, OSError) as e:
+                self.bot.logger.warning(f"{self.description} refresh failed: {e}")
+                if not self._loaded.is_set():
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 300)
+                    continue
+            await asyncio.sleep(self.interval)
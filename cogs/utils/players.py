@@ -0,0 +1,92 @@
+from cogs.utils.cache import get_data
+from cogs.utils.fuzzy import TrigramIndex
+from cogs.utils.loader import PeriodicLoader
+from cogs.utils.trie import PrefixTrie
+
+
+class PlayerIndex(PeriodicLoader):
+    """In-memory lookup of UW players by tag and by name, for PlayerConverter
+
+    Loaded from uw_push_1 and kept current by the update loops as they see
+    players, with a slow full reload as a safety net. Tags are stored without
+    the #, names are casefolded so lookups ignore case. Names are also kept in
+    a prefix trie for completion and a trigram index for near misses.
+    """
+    description = "Player index"
+
+    def __init__(self, bot, *, hours=12):
+        # tag -> {"player_name", "clan_tag", "clan_name"}
+        self.by_tag = {}
+        # casefolded name -> list of tags
+        self.by_name = {}
+        self.fuzzy = TrigramIndex()
+        self.prefixes = PrefixTrie()
+        super().__init__(bot, hours=hours)
+
+    def __len__(self):
+        return len(self.by_tag)
+
+    def __contains__(self, tag):
+        return tag in self.by_tag
+
+    async def load(self):
+        fetch = await get_data(self.bot.pool)
+        self.by_tag = {}
+        self.by_name = {}
+        self.fuzzy = TrigramIndex()
+        self.prefixes = PrefixTrie()
+        for row in fetch:
+            self.update(row['player_tag'], row['player_name'], row['clan_tag'], row['clan_name'])
+
+    def update(self, tag, name, clan_tag=None, clan_name=None):
+        """Add a player or record their new name/clan. A clan of None keeps the known one."""
+        entry = self.by_tag.get(tag)
+        if entry is None:
+            entry = self.by_tag[tag] = {"player_name": None, "clan_tag": None, "clan_name": None}
+        if entry['player_name'] != name:
+            if entry['player_name'] is not None:
+                self._unlink(tag, entry['player_name'])
+            self.by_name.setdefault(name.casefold(), []).append(tag)
+            self.fuzzy.add(tag, name)
+            self.prefixes.add(tag, name)
+            entry['player_name'] = name
+        if clan_tag is not None:
+            entry['clan_tag'] = clan_tag
+            entry['clan_name'] = clan_name
+
+    def update_players(self, players):
+        """Record the names and clans of coc.Player objects"""
+        for player in players:
+            self.update(player.tag[1:], player.name,
+                        player.clan.tag[1:] if player.clan else None,
+                        player.clan.name if player.clan else None)
+
+    def remove(self, tag):
+        entry = self.by_tag.pop(tag, None)
+        if entry is not None:
+            self._unlink(tag, entry['player_name'])
+            self.fuzzy.remove(tag)
+            self.prefixes.remove(tag)
+
+    def _unlink(self, tag, name):
+        key = name.casefold()
+        tags = self.by_name.get(key, [])
+        if tag in tags:
+            tags.remove(tag)
+        if not tags:
+            self.by_name.pop(key, None)
+
+    def get(self, tag):
+        return self.by_tag.get(tag)
+
+    def find(self, name):
+        """Return the tags of every player called name, ignoring case"""
+        return list(self.by_name.get(name.strip().casefold(), []))
+
+    def complete(self, prefix, limit=25):
+        """Return the tags of up to limit players whose names start with prefix"""
+        return self.prefixes.complete(prefix, limit)
+
+    def similar(self, name, k=5):
+        """Return the tags of up to k players with names close to name, best first"""
+        return [tag for _, tag in self.fuzzy.search(name, k)]
@@ -0,0 +1,54 @@
+import bisect
+
+
+class RankIndex:
+    """Players ordered by score, highest first, for rank and neighbour lookups
+
+    Kept as a sorted list of (-score, tag) keys, which matches the leaderboard's
+    ORDER BY score DESC, player_tag. Finding a player is a bisect; moving one is
+    a delete plus an insort.
+    """
+    def __init__(self):
+        self._keys = []
+        self._scores = {}
+        self._names = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, tag):
+        return tag in self._scores
+
+    def clear(self):
+        self._keys = []
+        self._scores = {}
+        self._names = {}
+
+    def update(self, tag, score, name=None):
+        """Add a player or move them to their new score"""
+        if name is not None:
+            self._names[tag] = name
+        old = self._scores.get(tag)
+        if old == score:
+            return
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, tag))]
+        bisect.insort(self._keys, (-score, tag))
+        self._scores[tag] = score
+
+    def remove(self, tag):
+        old = self._scores.pop(tag, None)
+        self._names.pop(tag, None)
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, tag))]
+
+    def rank(self, tag):
+        """Return the 1-based rank of tag"""
+        return bisect.bisect_left(self._keys, (-self._scores[tag], tag)) + 1
+
+    def neighbors(self, tag, distance=5):
+        """Return (rank, score, name, tag) for tag and up to `distance` players either side"""
+        index = self.rank(tag) - 1
+        start = max(index - distance, 0)
+        return [(rank, -score, self._names.get(other, other), other)
+                for rank, (score, other) in enumerate(self._keys[start:index + distance + 1], start + 1)]
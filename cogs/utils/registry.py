@@ -0,0 +1,94 @@
+import coc
+
+from cogs.utils.constants import clans as seed_clans
+from cogs.utils.loader import PeriodicLoader
+from cogs.utils.trie import PrefixTrie
+
+
+class ClanRegistry(PeriodicLoader):
+    """The UW clans, loaded from uw_clans
+
+    Held as tag -> {"clan_tag", "clan_name"} and casefolded name -> tag, so that
+    commands and converters can resolve clans without any API calls. Clan names
+    are kept current from the rosters RosterTracker already fetches, and the
+    list itself can be reloaded with `+reload clans` after editing the table.
+    Tags are stored with the # here and without it in the table.
+    """
+    description = "Clan registry"
+
+    def __init__(self, bot, *, hours=6):
+        self.clans = {}
+        self.by_name = {}
+        self.prefixes = PrefixTrie()
+        super().__init__(bot, hours=hours)
+
+    def __len__(self):
+        return len(self.clans)
+
+    def __contains__(self, tag):
+        return tag in self.clans
+
+    def __iter__(self):
+        return iter(self.clans)
+
+    @property
+    def tags(self):
+        return list(self.clans)
+
+    async def load(self):
+        conn = self.bot.pool
+        fetch = await conn.fetch("SELECT clan_tag, clan_name FROM uw_clans")
+        if not fetch:
+            # first run, the names are filled in by the next roster refresh
+            sql = "INSERT INTO uw_clans (clan_tag) SELECT unnest($1::text[]) ON CONFLICT DO NOTHING"
+            await conn.execute(sql, [tag[1:] for tag in seed_clans])
+            fetch = await conn.fetch("SELECT clan_tag, clan_name FROM uw_clans")
+        clans = {}
+        for row in fetch:
+            tag = f"#{row['clan_tag']}"
+            clans[tag] = {"clan_tag": tag, "clan_name": row['clan_name']}
+        self._index(clans)
+
+    def _index(self, clans):
+        by_name = {}
+        prefixes = PrefixTrie()
+        for tag, clan in clans.items():
+            if clan['clan_name']:
+                by_name[clan['clan_name'].casefold()] = tag
+                prefixes.add(tag, clan['clan_name'])
+        self.clans = clans
+        self.by_name = by_name
+        self.prefixes = prefixes
+
+    async def record_names(self, clans):
+        """Store the names of coc.Clan objects that have been renamed (or weren't known yet)"""
+        changed = [clan for clan in clans
+                   if clan.tag in self.clans and self.clans[clan.tag]['clan_name'] != clan.name]
+        if not changed:
+            return
+        sql = ("UPDATE uw_clans AS c SET clan_name = x.clan_name "
+               "FROM unnest($1::text[], $2::text[]) AS x(clan_tag, clan_name) "
+               "WHERE c.clan_tag = x.clan_tag")
+        await self.bot.pool.execute(sql, [clan.tag[1:] for clan in changed], [clan.name for clan in changed])
+        clans = dict(self.clans)
+        for clan in changed:
+            clans[clan.tag] = {"clan_tag": clan.tag, "clan_name": clan.name}
+        self._index(clans)
+
+    def get(self, tag):
+        """Return the clan for the tag (with or without #), or None"""
+        return self.clans.get(coc.utils.correct_tag(tag))
+
+    def get_name(self, tag):
+        """Return the clan name for the tag (with or without #), or the tag if unknown"""
+        tag = coc.utils.correct_tag(tag)
+        clan = self.clans.get(tag)
+        return clan['clan_name'] or tag if clan else tag
+
+    def find(self, name):
+        """Return the tag of the clan called name, ignoring case, or None"""
+        return self.by_name.get(name.strip().casefold())
+
+    def complete(self, prefix, limit=25):
+        """Return the tags of up to limit clans whose names start with prefix"""
+        return self.prefixes.complete(prefix, limit)
@@ -0,0 +1,120 @@
+import asyncio
+import asyncpg
+import coc
+
+from discord.ext import tasks
+from datetime import datetime, timedelta
+
+
+class RosterTracker:
+    """Last seen member list of every UW clan, with a record of who joins and leaves
+
+    Each refresh diffs the new rosters against the previous ones as sets. Changes
+    are stored in uw_clan_members / uw_roster_log and dispatched as `roster_join`
+    and `roster_leave` events with (player tag, Clan), so cogs can pick up new
+    participants without rescanning everything. When uw_clan_members starts out
+    empty, the first refresh only stores the rosters, since nobody actually joined.
+    """
+    def __init__(self, bot, *, minutes=10):
+        self.bot = bot
+        # clan tag -> set of member tags
+        self.members = None
+        # False until uw_clan_members holds a full set of rosters
+        self.seeded = False
+        # clan tag -> Clan from the latest refresh
+        self.clans = {}
+        self.refreshed_at = None
+        self._lock = asyncio.Lock()
+        self.refresh_loop.change_interval(minutes=minutes)
+        self.refresh_loop.start()
+
+    def close(self):
+        self.refresh_loop.cancel()
+
+    async def load(self):
+        sql = "SELECT player_tag, clan_tag FROM uw_clan_members"
+        fetch = await self.bot.pool.fetch(sql)
+        members = {}
+        for row in fetch:
+            members.setdefault(f"#{row['clan_tag']}", set()).add(f"#{row['player_tag']}")
+        self.members = members
+        self.seeded = bool(fetch)
+
+    async def refresh(self, *, max_age=None):
+        """Fetch the rosters and record any changes, unless they were refreshed within max_age
+
+        Returns whether the rosters were actually fetched.
+        """
+        async with self._lock:
+            now = datetime.utcnow()
+            if max_age and self.refreshed_at and now - self.refreshed_at < max_age:
+                return False
+            if self.members is None:
+                await self.load()
+            await self.bot.clan_registry.wait_until_loaded()
+            joins = []
+            leaves = []
+            latest = {}
+            members = dict(self.members)
+            async for clan in self.bot.coc.get_clans(self.bot.clan_registry.tags):
+                latest[clan.tag] = clan
+                current = {member.tag for member in clan.itermembers}
+                previous = members.get(clan.tag, set())
+                joins.extend((tag, clan) for tag in current - previous)
+                leaves.extend((tag, clan) for tag in previous - current)
+                members[clan.tag] = current
+            if self.seeded:
+                await self.record(joins, leaves, now)
+            else:
+                await self.record(joins, [], now, log=False)
+                joins = []
+                leaves = []
+            await self.bot.clan_registry.record_names(latest.values())
+            # only move on once the changes are stored, so a failed refresh is retried in full
+            self.members = members
+            self.clans = latest
+            self.refreshed_at = now
+            self.seeded = True
+        for tag, clan in joins:
+            self.bot.dispatch("roster_join", tag, clan)
+        for tag, clan in leaves:
+            self.bot.dispatch("roster_leave", tag, clan)
+        return True
+
+    async def record(self, joins, leaves, now, *, log=True):
+        if not joins and not leaves:
+            return
+        changes = [(tag[1:], clan.tag[1:], True) for tag, clan in joins]
+        changes.extend((tag[1:], clan.tag[1:], False) for tag, clan in leaves)
+        player_tags, clan_tags, joined = zip(*changes)
+        async with self.bot.pool.acquire() as conn:
+            async with conn.transaction():
+                sql = ("DELETE FROM uw_clan_members AS m "
+                       "USING unnest($1::text[], $2::text[], $3::bool[]) AS x(player_tag, clan_tag, joined) "
+                       "WHERE NOT x.joined AND m.player_tag = x.player_tag AND m.clan_tag = x.clan_tag")
+                await conn.execute(sql, player_tags, clan_tags, joined)
+                sql = ("INSERT INTO uw_clan_members (player_tag, clan_tag, joined_at) "
+                       "SELECT x.player_tag, x.clan_tag, $4 "
+                       "FROM unnest($1::text[], $2::text[], $3::bool[]) AS x(player_tag, clan_tag, joined) "
+                       "WHERE x.joined "
+                       "ON CONFLICT (player_tag) DO UPDATE "
+                       "SET clan_tag = excluded.clan_tag, joined_at = excluded.joined_at")
+                await conn.execute(sql, player_tags, clan_tags, joined, now)
+                if not log:
+                    return
+                sql = ("INSERT INTO uw_roster_log (player_tag, clan_tag, joined, logged_at) "
+                       "SELECT x.player_tag, x.clan_tag, x.joined, $4 "
+                       "FROM unnest($1::text[], $2::text[], $3::bool[]) AS x(player_tag, clan_tag, joined)")
+                await conn.execute(sql, player_tags, clan_tags, joined, now)
+
+    @tasks.loop(minutes=10)
+    async def refresh_loop(self):
+        try:
+            # the push loop may have just refreshed on its own schedule
+            await self.refresh(max_age=timedelta(minutes=5))
+        except (coc.ClashOfClansException, asyncpg.PostgresError, OSError) as e:
+            self.bot.logger.warning(f"Roster refresh failed: {e}")
+
+    @refresh_loop.before_loop
+    async def before_refresh_loop(self):
+        await self.bot.wait_until_ready()
@@ -0,0 +1,92 @@
+import heapq
+import time
+
+
+class PollScheduler:
+    """Decides which players are due to be polled
+
+    Every player starts at `min_interval`. A poll that finds a change keeps the
+    player at `min_interval`; a poll that finds nothing doubles the interval,
+    up to `max_interval`. Intervals are in seconds.
+
+    `polls` counts the API calls actually made and `baseline` accumulates what
+    polling `baseline_count` players every `baseline_interval` would have cost
+    over the same time, so the two can be compared directly.
+    """
+    def __init__(self, *, min_interval=240, max_interval=2880, baseline_interval=720):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.baseline_interval = baseline_interval
+        self._heap = []
+        self._intervals = {}
+        self._due = {}
+        self.polls = 0
+        self.baseline = 0.0
+        self._last_tick = None
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def __iter__(self):
+        return iter(self._intervals)
+
+    def __contains__(self, tag):
+        return tag in self._intervals
+
+    def clear(self):
+        self._heap = []
+        self._intervals = {}
+        self._due = {}
+        self.polls = 0
+        self.baseline = 0.0
+        self._last_tick = None
+
+    def add(self, tag, now=None):
+        """Start polling tag, due immediately"""
+        now = time.monotonic() if now is None else now
+        self._intervals[tag] = self.min_interval
+        self._push(tag, now)
+
+    def remove(self, tag):
+        """Stop polling tag. Its heap entry is dropped lazily."""
+        self._intervals.pop(tag, None)
+        self._due.pop(tag, None)
+
+    def _push(self, tag, due):
+        self._due[tag] = due
+        heapq.heappush(self._heap, (due, tag))
+
+    def pop_due(self, baseline_count, now=None):
+        """Return the tags that are due and charge the baseline for the time since the last call"""
+        now = time.monotonic() if now is None else now
+        if self._last_tick is not None:
+            self.baseline += baseline_count * (now - self._last_tick) / self.baseline_interval
+        self._last_tick = now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, tag = heapq.heappop(self._heap)
+            # skip entries left behind by remove() or a later add()
+            if self._due.get(tag) == when:
+                del self._due[tag]
+                due.append(tag)
+        self.polls += len(due)
+        return due
+
+    def reschedule(self, tag, changed, now=None):
+        """Put a polled tag back in the queue, backing off if nothing changed"""
+        if tag not in self._intervals:
+            return
+        now = time.monotonic() if now is None else now
+        if changed:
+            interval = self.min_interval
+        else:
+            interval = min(self._intervals[tag] * 2, self.max_interval)
+        self._intervals[tag] = interval
+        self._push(tag, now + interval)
+
+    @property
+    def saving(self):
+        """Fraction of the fixed-interval API calls that were avoided"""
+        if not self.baseline:
+            return 0.0
+        return 1 - self.polls / self.baseline
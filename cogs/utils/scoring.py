@@ -0,0 +1,38 @@
+# Trophy offset per TH level used before any rules are stored for an event
+DEFAULT_OFFSETS = {13: 5000, 12: 4000, 11: 3500, 10: 3000}
+
+
+class ScoringRules:
+    """Per-event push scoring: trophies minus an offset for the player's TH level
+
+    Players below the lowest configured TH level are not scored. TH levels
+    above it without an offset of their own score 1, as the original
+    leaderboard did.
+    """
+    def __init__(self, offsets=None):
+        self.offsets = dict(offsets or DEFAULT_OFFSETS)
+
+    @classmethod
+    async def load(cls, conn, event_id):
+        sql = "SELECT th_level, trophy_offset FROM uw_push_scoring WHERE event_id = $1"
+        fetch = await conn.fetch(sql, event_id)
+        return cls({row['th_level']: row['trophy_offset'] for row in fetch} or None)
+
+    def score(self, th_level, trophies):
+        """Return the score for one player, or None if they aren't scored"""
+        if th_level is None or th_level < min(self.offsets):
+            return None
+        if th_level not in self.offsets:
+            return 1
+        return trophies - self.offsets[th_level]
+
+    def scores(self, th_levels, trophies):
+        """Score parallel sequences of TH levels and trophies in one pass"""
+        offsets = self.offsets
+        lowest = min(offsets)
+        return [None if th is None or th < lowest else trophy - offsets[th] if th in offsets else 1
+                for th, trophy in zip(th_levels, trophies)]
+
+    def describe(self):
+        """One line per TH level, highest first, for embeds"""
+        return "\n".join(f"TH{th} -{offset}" for th, offset in sorted(self.offsets.items(), reverse=True))
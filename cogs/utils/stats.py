@@ -0,0 +1,66 @@
+class PushStats:
+    """Headline push numbers, kept up to date as trophies are written
+
+    Each player's trophies and gain are held so the maxima can be moved on a
+    single update. They only have to be worked out again from scratch when the
+    current leader's value actually goes down.
+    """
+    def __init__(self):
+        self._starting = {}
+        self._trophies = {}
+        self._names = {}
+        self._top = None
+        self._top_gain = None
+        self.updated = None
+
+    def __len__(self):
+        return len(self._trophies)
+
+    def clear(self):
+        self._starting = {}
+        self._trophies = {}
+        self._names = {}
+        self._top = None
+        self._top_gain = None
+
+    def _gain(self, tag):
+        return self._trophies[tag] - self._starting[tag]
+
+    def update(self, tag, trophies, *, starting=None, name=None):
+        """Record a player's trophies. `starting` is only needed the first time a player is seen."""
+        old = self._trophies.get(tag)
+        old_gain = self._gain(tag) if old is not None else None
+        if starting is not None:
+            self._starting[tag] = starting
+        elif tag not in self._starting:
+            self._starting[tag] = trophies
+        if name is not None:
+            self._names[tag] = name
+        self._trophies[tag] = trophies
+        gain = self._gain(tag)
+        if self._top is None:
+            self._top = tag
+        elif tag == self._top:
+            if old is not None and trophies < old:
+                self._top = max(self._trophies, key=self._trophies.get)
+        elif trophies > self._trophies[self._top]:
+            self._top = tag
+        if self._top_gain is None:
+            self._top_gain = tag
+        elif tag == self._top_gain:
+            if old_gain is not None and gain < old_gain:
+                self._top_gain = max(self._trophies, key=self._gain)
+        elif gain > self._gain(self._top_gain):
+            self._top_gain = tag
+
+    @property
+    def max_trophies(self):
+        if self._top is None:
+            return None
+        return self._trophies[self._top], self._names.get(self._top, self._top)
+
+    @property
+    def max_gain(self):
+        if self._top_gain is None:
+            return None
+        return self._gain(self._top_gain), self._names.get(self._top_gain, self._top_gain)
@@ -0,0 +1,45 @@
+from cogs.utils import db
+
+# Tables the bot creates for itself on startup. The event tables (rcs_events,
+# uw_clan_games, uw_push_1) are managed outside of the bot. uw_clans is the list
+# of UW clans; it is seeded once from constants.py and edited by hand after that.
+
+
+class Players(db.Table, table_name="uw_players"):
+    player_tag = db.Column(db.String, primary_key=True)
+    player_name = db.Column(db.String)
+    clan_tag = db.Column(db.String, index=True)
+    clan_name = db.Column(db.String)
+    updated = db.Column(db.Datetime, default="NOW() AT TIME ZONE 'utc'")
+
+
+class ClanMembers(db.Table, table_name="uw_clan_members"):
+    player_tag = db.Column(db.String, primary_key=True)
+    clan_tag = db.Column(db.String, index=True)
+    joined_at = db.Column(db.Datetime)
+
+
+class RosterLog(db.Table, table_name="uw_roster_log"):
+    id = db.PrimaryKeyColumn()
+    player_tag = db.Column(db.String, index=True)
+    clan_tag = db.Column(db.String)
+    joined = db.Column(db.Boolean)
+    logged_at = db.Column(db.Datetime)
+
+
+class PushScoring(db.Table, table_name="uw_push_scoring"):
+    event_id = db.Column(db.Integer, primary_key=True)
+    th_level = db.Column(db.Integer, primary_key=True)
+    trophy_offset = db.Column(db.Integer)
+
+
+class PushHistory(db.Table, table_name="uw_push_history"):
+    id = db.PrimaryKeyColumn()
+    player_tag = db.Column(db.String)
+    trophies = db.Column(db.Integer)
+    taken_at = db.Column(db.Datetime)
+
+
+class Clans(db.Table, table_name="uw_clans"):
+    clan_tag = db.Column(db.String, primary_key=True)
+    clan_name = db.Column(db.String)
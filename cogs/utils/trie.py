@@ -0,0 +1,68 @@
+from cogs.utils.fuzzy import normalize
+
+
+class _Node:
+    __slots__ = ("children", "keys")
+
+    def __init__(self):
+        self.children = {}
+        self.keys = set()
+
+
+class PrefixTrie:
+    """Name completion: every key whose name starts with what has been typed so far
+
+    Names go through the same normalisation as the fuzzy index, so accents,
+    case and emoji don't get in the way. A completion walks down the prefix and
+    then walks the subtree in order only until `limit` keys are found, so a short
+    prefix matching thousands of names costs no more than a long one.
+    """
+    def __init__(self):
+        self._root = _Node()
+        # key -> normalised name it is stored under
+        self._names = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, key, text):
+        """Index key under text, replacing whatever key had before"""
+        self.remove(key)
+        name = normalize(text)
+        node = self._root
+        for char in name:
+            node = node.children.setdefault(char, _Node())
+        node.keys.add(key)
+        self._names[key] = name
+
+    def remove(self, key):
+        name = self._names.pop(key, None)
+        if name is None:
+            return
+        path = [self._root]
+        for char in name:
+            path.append(path[-1].children[char])
+        path[-1].keys.discard(key)
+        # prune the branch back to the last node still in use
+        for depth in range(len(name), 0, -1):
+            if path[depth].keys or path[depth].children:
+                break
+            del path[depth - 1].children[name[depth - 1]]
+
+    def complete(self, prefix, limit=25):
+        """Return up to limit keys whose names start with prefix, in alphabetical order"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            found.extend(sorted(node.keys, key=str))
+            stack.extend(node.children[char] for char in sorted(node.children, reverse=True))
+        return found[:limit]
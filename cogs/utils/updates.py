@@ -0,0 +1,45 @@
+class PlayerUpdates:
+    """The players registered with the events client, shared between cogs
+
+    coc.py keeps a single set of tags for player updates, so one cog removing a
+    tag would also stop the updates another cog is relying on. Cogs register
+    and release tags here under their own name instead, and a tag is only
+    removed from the client once no cog wants it any more.
+    """
+    def __init__(self, client):
+        self.client = client
+        # tag (with #) -> names of the cogs that want its updates
+        self.owners = {}
+
+    def __len__(self):
+        return len(self.owners)
+
+    def __contains__(self, tag):
+        return tag in self.owners
+
+    def add(self, owner, *tags):
+        new_tags = []
+        for tag in tags:
+            owners = self.owners.setdefault(tag, set())
+            if not owners:
+                new_tags.append(tag)
+            owners.add(owner)
+        if new_tags:
+            self.client.add_player_updates(*new_tags)
+
+    def remove(self, owner, *tags):
+        old_tags = []
+        for tag in tags:
+            owners = self.owners.get(tag)
+            if not owners or owner not in owners:
+                continue
+            owners.remove(owner)
+            if not owners:
+                del self.owners[tag]
+                old_tags.append(tag)
+        if old_tags:
+            self.client.remove_player_updates(*old_tags)
+
+    def remove_all(self, owner):
+        """Release every tag registered by owner"""
+        self.remove(owner, *[tag for tag, owners in self.owners.items() if owner in owners])